@@ -1,65 +1,282 @@
-import subprocess
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from scripts.lexicalModel import LexicalModel
 from scripts.languageModel import SentenceSplitter
 from scripts.languageModel import CalculateProbability
+from scripts.languageModel import MappedCalculateProbability
+from scripts.languageModel import SPLITTER_MODES
 from scripts.phonemicTranscription import phone_recognize_file
-import pandas
+from scripts.phonemicTranscription import phone_recognize_batch
+from scripts.phonemicTranscription import split_at_pauses
+from scripts.phonemicTranscription import get_recognizer, recognizer_loaded
+from scripts.textNormalization import join_runs, segmentation_runs
+from scripts.transcriptionCache import TranscriptionCache, audio_key, content_key
+from scripts import metrics
 
 class ASR(object):
     def __init__(self,unigram_file_path = './data/text/unigrams_log.tsv',
-        bigram_file_path = './data/text/bigrams_log.tsv'):
+        bigram_file_path = './data/text/bigrams_log.tsv',
+        compiled_language_model_path = './data/text/language_model.bin',
+        lexical_model_backend = 'ctranslate2',
+        chunk_workers = 4,
+        cache_memory_bytes = 64*1024*1024,
+        cache_disk_path = None,
+        lazy_lexical_model = False,
+        lexical_model_options = None):
         print("Initializing ASR Object...")
-        # Create an instance of CalculateProbability
-        calculator = CalculateProbability(unigram_file_path, bigram_file_path)
-        self.splitter =SentenceSplitter(calculator)
-        self.phoneme_file_location ='tmp/temp_phonemes.txt'
-        self.lexical_file_location ='tmp/temp_lexicon.txt'
+        # The language model is loaded on first use (or by warm_up), see the splitter property
+        self.unigram_file_path = unigram_file_path
+        self.bigram_file_path = bigram_file_path
+        self.compiled_language_model_path = compiled_language_model_path
+        self._splitter = None
+        self._splitter_lock = threading.Lock()
         self.lexical_model_path='lexical-model/model_released.pt'
+        # Loaded once and kept in memory, see scripts/lexicalModel.py. lexical_model_options are passed on to
+        # LexicalModel, e.g. {'converted_model_path': 'lexical-model/model_ct2_int8', 'intra_threads': 2}
+        options={'inter_threads':chunk_workers}
+        options.update(lexical_model_options or {})
+        self.lexical_model = LexicalModel(self.lexical_model_path, backend=lexical_model_backend,
+                                          lazy=lazy_lexical_model, **options)
+        self.chunk_workers = chunk_workers
+        self._chunk_executor = None
+        self._chunk_executor_pid = None
+        # Phonemes, lexemes and segmentations are cached separately, so changing only the splitter settings
+        # reuses the recognizer and lexical model results
+        self.cache = TranscriptionCache(max_memory_bytes=cache_memory_bytes, disk_path=cache_disk_path)
+        metrics.registry.callback('asr_cache_requests_total', "Cache lookups per stage and outcome.", 'counter',
+                                  self.cache_counts, ['stage', 'outcome'])
         print("...Finished Initializing ASR Object")
 
 
+    @property
+    def splitter(self)->SentenceSplitter:
+        if self._splitter is None:
+            with self._splitter_lock:
+                if self._splitter is None:
+                    # Prefer the memory-mapped model from scripts/compileLanguageModel.py
+                    if self.compiled_language_model_path and os.path.exists(self.compiled_language_model_path):
+                        calculator = MappedCalculateProbability(self.compiled_language_model_path)
+                    else:
+                        calculator = CalculateProbability(self.unigram_file_path, self.bigram_file_path)
+                    self._splitter = SentenceSplitter(calculator)
+        return self._splitter
+
+    def warm_up(self, load_lexical_model=True):
+        """
+        Loads the models that are otherwise loaded on first request. A pre-forking server calls this with
+        load_lexical_model=False before fork, so the language model and recognizer weights are shared by the
+        workers, and loads the lexical model in each worker after fork.
+        """
+        self.splitter.probability_calculator.vocabulary_trie
+        get_recognizer()
+        if load_lexical_model:
+            self.lexical_model.translator
+        else:
+            self.lexical_model.convert_model()
+
+    def is_warm(self)->bool:
+        return self._splitter is not None and recognizer_loaded() and self.lexical_model.is_loaded()
+
+    def cache_counts(self)->dict:
+        return {(stage, outcome): count for stage, counters in self.cache.stats().items() if isinstance(counters, dict)
+                for outcome, count in counters.items()}
+
+    def lexical_cache_key(self,input_text):
+        return content_key(self.lexical_model_path,self.lexical_model.converted_model_path,
+                           self.lexical_model.compute_type,self.lexical_model.beam_size,input_text)
+
     def translate_with_onmt(self,input_text):
-        #Write the input text to the source fil
-        with open(self.phoneme_file_location, 'w') as source_file:
-            source_file.write(input_text)
-        #run command to transcribe the phonenemes
-        command = ['onmt_translate', '-model', self.lexical_model_path, '-src', self.phoneme_file_location, '-output', self.lexical_file_location]
-        try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error during translation: {e}")
+        cache_key=self.lexical_cache_key(input_text)
+        cached=self.cache.get("lexemes",cache_key)
+        if cached is not None:
+            return cached
+        with metrics.timed("lexemes"):
+            translated_text = self.lexical_model.translate(input_text)
+        if translated_text is None:
             return None
-        #try to read the result
-        try:
-            with open(self.lexical_file_location, 'r') as output_file:
-                translated_text = output_file.read()
-        except FileNotFoundError:
-            print("Output file not found.")
-            return None
-        return translated_text.replace(" ","")
+        translated_text = translated_text.replace(" ","")
+        self.cache.put("lexemes",cache_key,translated_text)
+        return translated_text
+
+    def translate_batch_with_onmt(self,input_texts:list)->list:
+        cache_keys=[self.lexical_cache_key(input_text) for input_text in input_texts]
+        results=[self.cache.get("lexemes",cache_key) for cache_key in cache_keys]
+        missing=[index for index,result in enumerate(results) if result is None]
+        if missing:
+            with metrics.timed("lexemes_batch"):
+                translated_texts=self.lexical_model.translate_batch([input_texts[index] for index in missing])
+            for index,translated_text in zip(missing,translated_texts):
+                if translated_text is not None:
+                    results[index]=translated_text.replace(" ","")
+                    self.cache.put("lexemes",cache_keys[index],results[index])
+        return [None if result is None else result.replace("\n","") for result in results]
+
+    # wav_file_location can be a path or an in-memory wav file object, nothing is shared between calls
+    def generatePhonemicTranscription(self, wav_file_location)->str:
+        cache_key=audio_key(wav_file_location)
+        phonemes=self.cache.get("phonemes",cache_key)
+        if phonemes is None:
+            with metrics.timed("phonemes"):
+                phoneme_data=phone_recognize_file(wav_file_location)
+            phonemes=" ".join(phoneme_data.labels)
+            self.cache.put("phonemes",cache_key,phonemes)
+        return phonemes
+
+    def generatePhonemicTranscriptions(self, wav_file_locations:list)->list:
+        cache_keys=[audio_key(wav_file_location) for wav_file_location in wav_file_locations]
+        results=[self.cache.get("phonemes",cache_key) for cache_key in cache_keys]
+        missing=[index for index,result in enumerate(results) if result is None]
+        if missing:
+            with metrics.timed("phonemes_batch"):
+                phoneme_data_list=phone_recognize_batch([wav_file_locations[index] for index in missing])
+            for index,phoneme_data in zip(missing,phoneme_data_list):
+                results[index]=" ".join(phoneme_data.labels)
+                self.cache.put("phonemes",cache_keys[index],results[index])
+        return results
+
+    def generateUtterances(self, wav_file_location,min_pause=0.3,max_phonemes=200)->list:
+        """
+        The phonemes of the recording split into utterances at pauses (see split_at_pauses), one string per
+        utterance. Cached like generatePhonemicTranscription, whose cache entry it fills as well.
+        """
+        phonemes_key=audio_key(wav_file_location)
+        cache_key=content_key(phonemes_key,min_pause,max_phonemes)
+        utterances=self.cache.get("utterances",cache_key)
+        if utterances is not None:
+            return utterances.split("\n") if utterances else []
+        with metrics.timed("phonemes"):
+            phoneme_data=phone_recognize_file(wav_file_location)
+        self.cache.put("phonemes",phonemes_key," ".join(phoneme_data.labels))
+        utterances=[" ".join(chunk) for chunk in split_at_pauses(phoneme_data,min_pause=min_pause,max_phonemes=max_phonemes)]
+        self.cache.put("utterances",cache_key,"\n".join(utterances))
+        return utterances
 
-    def generatePhonemicTranscription(self, wav_file_location:str)->str:
-        phoneme_data:pandas.DataFrame=phone_recognize_file(wav_file_location)
+    # on_stage, if given, is called with ("phonemes", ...) and ("lexemes", ...) as the intermediate results are ready
+    # deadline, if given, is a time.monotonic() value after which segmentation finishes greedily (see SentenceSplitter)
+    def transcribeAudioFile(self, wav_file_location,splitterType="best first",width=3,on_stage=None,deadline=None)->str:# can choose between beem search, best first or viterbi
+        # Stages are timed as request_* so cache hits are included, unlike the phonemes and lexemes stages
+        record=metrics.request_record(wav_file_location,splitterType,width)
 
-        return " ".join(phoneme_data["label"].tolist())
-    def transcribeAudioFile(self, wav_file_location:str,splitterType="best first",width=3)->str:# can choose between beem search or best first
         print("Generating Phonemic transcription...")
-        phonemes=self.generatePhonemicTranscription(wav_file_location)
+        with metrics.timed("request_phonemes",record):
+            phonemes=self.generatePhonemicTranscription(wav_file_location)
+        metrics.observe_phonemes(record,phonemes)
         print("phonemes:",phonemes)
+        if on_stage:
+            on_stage("phonemes",phonemes)
+
         print("Generating Lexical transcription...")
-        lexemes=self.translate_with_onmt(input_text=phonemes)
+        with metrics.timed("request_lexemes",record):
+            lexemes=self.translate_with_onmt(input_text=phonemes)
+        if lexemes is None:
+            raise RuntimeError("Lexical transcription failed")
         lexemes=lexemes.replace("\n","")
         lexemes=lexemes.replace(" ", "")
+        metrics.observe_lexemes(record,lexemes)
         print("lexemes:",lexemes)
+        if on_stage:
+            on_stage("lexemes",lexemes)
+
         print("Splitting Data...")
+        with metrics.timed("request_split",record):
+            segmented=self.splitLexemes(lexemes,splitterType=splitterType,width=width,deadline=deadline)
+        print("timings:",json.dumps(record))
+        return segmented
 
-        if splitterType == "best first":
-            return self.splitter.best_first_split_sentence(sentence=lexemes,depth=width)
-        elif splitterType == "beam search":
-            return self.splitter.beam_search_split_sentence(sentence=lexemes,width=width)
-        else:
+    def transcribeUtterance(self, phonemes:str,splitterType="best first",width=3,deadline=None)->tuple:
+        # (lexemes, segmentation) of one utterance
+        lexemes=self.translate_with_onmt(input_text=phonemes)
+        if lexemes is None:
+            raise RuntimeError("Lexical transcription failed")
+        lexemes=lexemes.replace("\n","")
+        return lexemes,self.splitLexemes(lexemes,splitterType=splitterType,width=width,deadline=deadline)
+
+    def chunk_executor(self)->ThreadPoolExecutor:
+        # Created lazily and again after a fork, since worker threads do not survive fork
+        if self._chunk_executor is None or self._chunk_executor_pid != os.getpid():
+            self._chunk_executor = ThreadPoolExecutor(max_workers=self.chunk_workers)
+            self._chunk_executor_pid = os.getpid()
+        return self._chunk_executor
+
+    def transcribeAudioFileStream(self, wav_file_location,splitterType="best first",width=3,min_pause=0.3,max_phonemes=200,
+                                  deadline=None):
+        """
+        Splits the recording into utterances at pauses (see split_at_pauses), translates and segments the
+        utterances in parallel, and yields their transcriptions in order as soon as each one is ready.
+        """
+        record=metrics.request_record(wav_file_location,splitterType,width)
+        with metrics.timed("request_phonemes",record):
+            utterances=self.generateUtterances(wav_file_location,min_pause=min_pause,max_phonemes=max_phonemes)
+        metrics.observe_phonemes(record," ".join(utterances))
+        print(f"Transcribing {len(utterances)} utterances...")
+        executor=self.chunk_executor()
+        futures=[executor.submit(self.transcribeUtterance,utterance,splitterType,width,deadline) for utterance in utterances]
+        lexemes=[]
+        try:
+            # Lexemes and segmentation overlap across utterances, so they are timed together
+            with metrics.timed("request_utterances",record):
+                for future in futures:
+                    utterance_lexemes,segmented=future.result()
+                    lexemes.append(utterance_lexemes)
+                    yield segmented
+            metrics.observe_lexemes(record,"".join(lexemes))
+            print("timings:",json.dumps(record))
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def splitLexemes(self, lexemes:str,splitterType="best first",width=3,deadline=None)->str:
+        # Punctuation is a word boundary in the language model counts, so each run between punctuation is
+        # segmented on its own and the punctuation is kept in the output
+        runs,punctuation=segmentation_runs(lexemes)
+        return join_runs([self.splitRun(run,splitterType,width,deadline) for run in runs],punctuation)
+
+    def splitRun(self, run:str,splitterType="best first",width=3,deadline=None)->str:
+        if not run:
+            return ""
+        cache_key=content_key(splitterType,width,run)
+        segmented=self.cache.get("segmentation",cache_key)
+        if segmented is None:
+            segmented=self.runSplitter(run,splitterType=splitterType,width=width,deadline=deadline)
+            # A segmentation cut short by the deadline is not the answer for this key
+            if deadline is None or time.monotonic()<deadline:
+                self.cache.put("segmentation",cache_key,segmented)
+        return segmented
+
+    def runSplitter(self, lexemes:str,splitterType="best first",width=3,deadline=None)->str:
+        if splitterType not in SPLITTER_MODES:
             raise RuntimeError(f"Unknown splitter type: {splitterType}")
+        with metrics.timed("split_"+splitterType.replace(" ","_")):
+            return self.splitter.split(lexemes,mode=splitterType,width=width,deadline=deadline)
 
+    def splitLexemesMany(self, lexemes_list:list,splitterType="best first",width=3,deadline=None)->list:
+        """
+        splitLexemes for many strings at once, in input order. The runs not in the cache are segmented
+        across the splitter's process pool, see SentenceSplitter.split_many and start_pool.
+        """
+        if splitterType not in SPLITTER_MODES:
+            raise RuntimeError(f"Unknown splitter type: {splitterType}")
+        split_list=[segmentation_runs(lexemes) for lexemes in lexemes_list]
+        runs=sorted({run for run_list,_ in split_list for run in run_list if run})
+        cache_keys=[content_key(splitterType,width,run) for run in runs]
+        results=[self.cache.get("segmentation",cache_key) for cache_key in cache_keys]
+        missing=[index for index,result in enumerate(results) if result is None]
+        if missing:
+            with metrics.timed("split_many_"+splitterType.replace(" ","_")):
+                segmented_list=self.splitter.split_many([runs[index] for index in missing],mode=splitterType,
+                                                        width=width,deadline=deadline)
+            complete=deadline is None or time.monotonic()<deadline
+            for index,segmented in zip(missing,segmented_list):
+                results[index]=segmented
+                if complete:
+                    self.cache.put("segmentation",cache_keys[index],segmented)
+        segmented_runs=dict(zip(runs,results))
+        segmented_runs[""]=""
+        return [join_runs([segmented_runs[run] for run in run_list],punctuation) for run_list,punctuation in split_list]
 
 if __name__ == '__main__':
     asr =ASR()
@@ -0,0 +1,172 @@
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class JobStore:
+    """
+    Job states as one JSON file per job id under directory. Every process that shares the directory, such as
+    the workers of a pre-forking server, sees every job, whichever process runs it.
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _file(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def save(self, state):
+        path = self._file(state['job_id'])
+        # Write to a private file first so readers never see a partial state
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False)
+        os.replace(temporary_path, path)
+
+    def load(self, job_id):
+        # Only ids this store made name a file, anything else could escape the directory
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._file(job_id), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, job_id):
+        try:
+            os.remove(self._file(job_id))
+        except FileNotFoundError:
+            pass
+
+    def expire(self, job_ttl):
+        """
+        Deletes the jobs that finished more than job_ttl seconds ago.
+        """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            job_id, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            try:
+                # A job is last written when it finishes, so only files this old can hold an expired job
+                if now - os.path.getmtime(os.path.join(self.directory, name)) <= job_ttl:
+                    continue
+            except FileNotFoundError:
+                continue
+            state = self.load(job_id)
+            if state is not None and state['finished'] is not None and now - state['finished'] > job_ttl:
+                self.delete(job_id)
+
+
+class Job:
+    def __init__(self, wav_file, splitter_type, width, store):
+        self.id = uuid.uuid4().hex
+        self.wav_file = wav_file
+        self.splitter_type = splitter_type
+        self.width = width
+        self.store = store
+        self.status = 'queued'
+        self.partial = {}
+        self.transcription = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def on_stage(self, stage, value):
+        self.partial[stage] = value
+        self.save()
+
+    def save(self):
+        self.store.save(self.to_dict())
+
+    def to_dict(self):
+        return {'job_id': self.id, 'status': self.status, 'partial': dict(self.partial),
+                'transcription': self.transcription, 'error': self.error,
+                'created': self.created, 'finished': self.finished}
+
+
+class JobManager:
+    """
+    Runs transcriptions in a pool of background worker threads so that long recordings do not hold an
+    HTTP connection open. At most max_queued_jobs jobs wait at a time, and finished jobs are forgotten
+    job_ttl seconds after they complete. Segmentation stops job_timeout seconds after a job starts running
+    and finishes greedily, as it does for /transcribe after request_timeout.
+
+    Job states are kept in a JobStore under job_dir, so any process sharing job_dir can report a job that
+    another one runs. Without job_dir, a new temporary directory is made here, which is shared by the
+    processes forked after this.
+    """
+    def __init__(self, asr_system, num_workers=2, max_queued_jobs=32, job_ttl=3600, job_timeout=300,
+                 job_dir=None):
+        self.asr_system = asr_system
+        self.num_workers = num_workers
+        self.max_queued_jobs = max_queued_jobs
+        self.job_ttl = job_ttl
+        self.job_timeout = job_timeout
+        self.store = JobStore(job_dir or tempfile.mkdtemp(prefix='asr-jobs-'))
+        self.pending = queue.Queue(maxsize=max_queued_jobs)
+        self._workers_lock = threading.Lock()
+        self._workers = []
+        self._workers_pid = None
+
+    def submit(self, wav_file, splitter_type, width) -> Job:
+        """
+        Queues a transcription and returns its Job. Raises queue.Full when max_queued_jobs jobs are waiting.
+        """
+        self._ensure_started()
+        self.expire_jobs()
+        job = Job(wav_file, splitter_type, width, self.store)
+        job.save()
+        try:
+            self.pending.put_nowait(job)
+        except queue.Full:
+            self.store.delete(job.id)
+            raise
+        return job
+
+    def get(self, job_id):
+        """
+        The state of a job as Job.to_dict() returns it, or None for unknown and expired jobs.
+        """
+        self.expire_jobs()
+        return self.store.load(job_id)
+
+    def expire_jobs(self):
+        self.store.expire(self.job_ttl)
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so a forked child starts its own pool
+        with self._workers_lock:
+            if self._workers and self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self._workers = [threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True)
+                             for index in range(self.num_workers)]
+            for worker in self._workers:
+                worker.start()
+
+    def _run(self):
+        while True:
+            job = self.pending.get()
+            job.status = 'running'
+            job.save()
+            deadline = time.monotonic() + self.job_timeout
+            try:
+                job.transcription = self.asr_system.transcribeAudioFile(job.wav_file, splitterType=job.splitter_type,
+                                                                        width=job.width, on_stage=job.on_stage,
+                                                                        deadline=deadline)
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.status = 'failed'
+            job.wav_file = None
+            job.finished = time.time()
+            job.save()
@@ -1,28 +1,317 @@
+import argparse
+import json
+import math
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from flask import Flask, request, jsonify, app
+from flask import Flask, Response, request, jsonify, app, stream_with_context
 from ASR import ASR
+from scripts.languageModel import SPLITTER_MODES
+from JobManager import JobManager
+from scripts import metrics
+from scripts.audioFrontend import AudioFrontend
+from scripts.phonemicTranscription import recognizer_sample_rate
 from flask_cors import CORS
 
-from pydub import AudioSegment
+
+
+batch_sizes = metrics.registry.histogram('asr_batch_size', "Requests per batch run by the scheduler.",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64))
+request_errors = metrics.registry.counter('asr_request_errors_total', "Requests answered with an error status.",
+                                          ['endpoint', 'status'])
+
+
+class TranscriptionRequest:
+    def __init__(self, wav_file, splitter_type, width, deadline=None):
+        self.wav_file = wav_file
+        self.splitter_type = splitter_type
+        self.width = width
+        self.deadline = deadline
+        self.future = Future()
+
+
+class BatchScheduler:
+    """
+    Collects /transcribe requests that arrive within batch_window_ms of each other, up to max_batch_size,
+    and runs phoneme recognition and translation for them as single batched calls. Segmentation runs per
+    request with its own splitter settings, and every result is delivered through the request's Future.
+    """
+    def __init__(self, asr_system, max_batch_size=8, batch_window_ms=20, max_queue_depth=64):
+        self.asr_system = asr_system
+        self.max_batch_size = max_batch_size
+        self.batch_window_ms = batch_window_ms
+        self.max_queue_depth = max_queue_depth
+        self.requests = queue.Queue(maxsize=max_queue_depth)
+        self.batches_processed = 0
+        self.last_batch_size = 0
+        # Moving average of the time one batch takes, used to tell rejected clients when to retry
+        self.average_batch_seconds = 1.0
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def settings(self):
+        return {'queue_depth': self.queue_depth(), 'max_queue_depth': self.max_queue_depth,
+                'max_batch_size': self.max_batch_size, 'batch_window_ms': self.batch_window_ms,
+                'batches_processed': self.batches_processed, 'last_batch_size': self.last_batch_size,
+                'average_batch_seconds': round(self.average_batch_seconds, 3)}
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the queue has roughly drained, for the Retry-After header.
+        """
+        return max(1, math.ceil((self.queue_depth() / self.max_batch_size + 1) * self.average_batch_seconds))
+
+    def submit(self, wav_file, splitter_type, width, deadline=None) -> Future:
+        """
+        Queues a request and returns its Future. Raises queue.Full when max_queue_depth requests are waiting.
+        """
+        self._ensure_started()
+        transcription_request = TranscriptionRequest(wav_file, splitter_type, width, deadline)
+        self.requests.put_nowait(transcription_request)
+        return transcription_request.future
+
+    def _ensure_started(self):
+        # Started on first use, and again in a forked child since threads do not survive fork
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker is None or self._worker_pid != os.getpid():
+                self._worker = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def _collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_window_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Requests whose caller stopped waiting were cancelled and are dropped here
+            batch = [item for item in self._collect_batch() if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.last_batch_size = len(batch)
+            batch_sizes.observe(len(batch))
+            batch_start = time.monotonic()
+            self._process(batch)
+            self.average_batch_seconds = 0.8 * self.average_batch_seconds + 0.2 * (time.monotonic() - batch_start)
+            self.batches_processed += 1
+
+    @staticmethod
+    def _run_stage(inputs, errors, batched):
+        """
+        Runs batched over the inputs of the requests that have no error yet. When the batched call fails, the
+        inputs are retried one at a time, so only the requests that fail again get an error.
+        """
+        indices = [index for index, error in enumerate(errors) if error is None]
+        outputs = [None] * len(inputs)
+        if not indices:
+            return outputs
+        try:
+            for index, output in zip(indices, batched([inputs[index] for index in indices])):
+                outputs[index] = output
+        except Exception:
+            for index in indices:
+                try:
+                    outputs[index] = batched([inputs[index]])[0]
+                except Exception as e:
+                    errors[index] = e
+        return outputs
+
+    def _process(self, batch):
+        # Each request keeps its own record and error, so one bad request does not fail the rest of the batch.
+        # The batched stages are timed once and their durations copied into the record of every request.
+        records = [None] * len(batch)
+        errors = [None] * len(batch)
+        for index, item in enumerate(batch):
+            try:
+                records[index] = metrics.request_record(item.wav_file, item.splitter_type, item.width)
+            except Exception as e:
+                errors[index] = e
+        batch_record = {}
+        with metrics.timed("request_phonemes", batch_record):
+            phonemes = self._run_stage([item.wav_file for item in batch], errors,
+                                       self.asr_system.generatePhonemicTranscriptions)
+        with metrics.timed("request_lexemes", batch_record):
+            lexemes = self._run_stage(phonemes, errors, self.asr_system.translate_batch_with_onmt)
+        for item, record, error, item_phonemes, item_lexemes in zip(batch, records, errors, phonemes, lexemes):
+            if error is not None:
+                item.future.set_exception(error)
+                continue
+            try:
+                record["batch_size"] = len(batch)
+                record["stages"].update(batch_record["stages"])
+                metrics.observe_phonemes(record, item_phonemes)
+                if item_lexemes is None:
+                    raise RuntimeError("Lexical transcription failed")
+                metrics.observe_lexemes(record, item_lexemes)
+                with metrics.timed("request_split", record):
+                    segmented = self.asr_system.splitLexemes(item_lexemes, splitterType=item.splitter_type,
+                                                             width=item.width, deadline=item.deadline)
+                print("timings:", json.dumps(record))
+                item.future.set_result(segmented)
+            except Exception as e:
+                item.future.set_exception(e)
+
 
 class ASRServer:
-    def __init__(self):
+    def __init__(self, max_batch_size=8, batch_window_ms=20, max_queue_depth=64,
+                 job_workers=2, max_queued_jobs=32, job_ttl=3600, job_timeout=300, job_dir=None,
+                 cache_memory_mb=64, cache_dir=None, max_ffmpeg_processes=2, lazy_lexical_model=False, max_width=32,
+                 max_depth=6, request_timeout=30, max_streams=4, retry_after=5, segment_workers=None,
+                 max_segment_sentences=10000, max_segment_requests=2, lexical_model_options=None):
         self.app = Flask(__name__)
         CORS(self.app)
+        self.max_batch_size = max_batch_size
+        self.batch_window_ms = batch_window_ms
+        self.max_queue_depth = max_queue_depth
+        self.job_workers = job_workers
+        self.max_queued_jobs = max_queued_jobs
+        self.job_ttl = job_ttl
+        self.job_timeout = job_timeout
+        self.job_dir = job_dir
+        self.cache_memory_mb = cache_memory_mb
+        self.cache_dir = cache_dir
+        self.lazy_lexical_model = lazy_lexical_model
+        self.lexical_model_options = lexical_model_options
+        # Admission control: width and depth caps, the longest a request may spend segmenting, and the
+        # number of streaming transcriptions running at once
+        self.max_width = max_width
+        self.max_depth = max_depth
+        self.request_timeout = request_timeout
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+        self.retry_after = retry_after
+        # /segment spreads each call over the segment_workers processes of one pool, forked by
+        # start_segment_pool, so only a few calls run at once
+        self.segment_workers = segment_workers
+        self.max_segment_sentences = max_segment_sentences
+        self.segment_slots = threading.BoundedSemaphore(max_segment_requests)
+        self.audio_frontend = AudioFrontend(sample_rate=recognizer_sample_rate,
+                                            max_ffmpeg_processes=max_ffmpeg_processes)
         self.setup_routes()
 
     def saveFile(self, file):
+        # Decode the upload in memory so concurrent requests never share a file on disk
+        with metrics.timed("save_file"):
+            return self.decodeUpload(file)
+
+    def decodeUpload(self, file):
         if file:
-            file_path = os.path.join("tmp", file.filename)
-            file.save(file_path)  # Save the original file first
-            # Convert to WAV using pydub
-            sound = AudioSegment.from_file(file_path)
-            wav_path = os.path.join("tmp", "input.wav")
-            sound.export(wav_path, format="wav")
+            # (samples, sample_rate) at the recognizer's rate, handed straight to the recognizer
+            return self.audio_frontend.decode(file.read())
+
+    def splitterSettings(self, form):
+        """
+        Reads and checks splitterType and width. Raises ValueError for unknown types and widths over the caps.
+        """
+        splitter_type = form.get('splitterType', 'best first')
+        width = int(form.get('width', 3))
+        if splitter_type not in SPLITTER_MODES:
+            raise ValueError(f"Unknown splitter type: {splitter_type}")
+        limit = self.max_depth if splitter_type == "best first" else self.max_width
+        if not 1 <= width <= limit:
+            raise ValueError(f"width must be between 1 and {limit} for {splitter_type}")
+        return splitter_type, width
+
+    def requestDeadline(self, form):
+        # Clients may ask for a shorter deadline than request_timeout, never a longer one
+        timeout = float(form.get('timeout', self.request_timeout))
+        if not math.isfinite(timeout):
+            raise ValueError("timeout must be a finite number of seconds")
+        timeout = min(timeout, self.request_timeout)
+        return time.monotonic() + max(timeout, 0)
+
+    def busy(self, message, retry_after):
+        return jsonify({'error': message}), 503, {'Retry-After': str(retry_after)}
 
     def setup_routes(self):
-        self.asr_system = ASR()
+        self.asr_system = ASR(cache_memory_bytes=int(self.cache_memory_mb * 1024 * 1024),
+                              cache_disk_path=self.cache_dir, lazy_lexical_model=self.lazy_lexical_model,
+                              lexical_model_options=self.lexical_model_options)
+        self.scheduler = BatchScheduler(self.asr_system, max_batch_size=self.max_batch_size,
+                                        batch_window_ms=self.batch_window_ms, max_queue_depth=self.max_queue_depth)
+
+        self.job_manager = JobManager(self.asr_system, num_workers=self.job_workers,
+                                      max_queued_jobs=self.max_queued_jobs, job_ttl=self.job_ttl,
+                                      job_timeout=self.job_timeout, job_dir=self.job_dir)
+
+        @self.app.route('/jobs', methods=['POST'])
+        def create_job():
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file part'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No selected file'}), 400
+
+            try:
+                splitter_type, width = self.splitterSettings(request.form)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            try:
+                wav_file = self.saveFile(file)
+                job = self.job_manager.submit(wav_file, splitter_type, width)
+            except queue.Full:
+                return self.busy('Too many queued jobs, try again later', self.retry_after)
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+            return jsonify({'job_id': job.id, 'status': job.status}), 202, {'Location': f'/jobs/{job.id}'}
+
+        @self.app.route('/jobs/<job_id>', methods=['GET'])
+        def get_job(job_id):
+            state = self.job_manager.get(job_id)
+            if state is None:
+                return jsonify({'error': 'Unknown or expired job'}), 404
+            return jsonify(state)
+
+        metrics.registry.callback('asr_scheduler_queue_depth', "Requests waiting for the batch scheduler.", 'gauge',
+                                  lambda: {(): self.scheduler.queue_depth()})
+        metrics.registry.callback('asr_job_queue_depth', "Jobs waiting for a job worker.", 'gauge',
+                                  lambda: {(): self.job_manager.pending.qsize()})
+
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+        @self.app.after_request
+        def count_errors(response):
+            if response.status_code >= 400:
+                request_errors.inc(endpoint=request.url_rule.rule if request.url_rule else 'unknown',
+                                   status=response.status_code)
+            return response
+
+        @self.app.route('/cache', methods=['GET'])
+        def cache_status():
+            return jsonify(self.asr_system.cache.stats())
+
+        @self.app.route('/ready', methods=['GET'])
+        def ready():
+            # 503 until the recognizer and lexical model are loaded in this worker
+            warm = self.asr_system.is_warm()
+            return jsonify({'ready': warm, 'pid': os.getpid()}), 200 if warm else 503
+
+        @self.app.route('/scheduler', methods=['GET'])
+        def scheduler_status():
+            return jsonify(self.scheduler.settings())
+
         @self.app.route('/transcribe', methods=['POST'])
         def transcribe_audio():
             if 'file' not in request.files:
@@ -33,20 +322,152 @@ class ASRServer:
                 return jsonify({'error': 'No selected file'}), 400
 
             # Extract splitter type from form data, default to "best first" if not provided
-            splitter_type = request.form.get('splitterType', 'best first')
-            width = int(request.form.get('width', 3))  # Default width to 3 if not provided
+            try:
+                splitter_type, width = self.splitterSettings(request.form)
+                deadline = self.requestDeadline(request.form)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
 
-            self.saveFile(file)
+            try:
+                wav_file = self.saveFile(file)
+                future = self.scheduler.submit(wav_file, splitter_type, width, deadline)
+            except queue.Full:
+                return self.busy('Server is busy, try again later', self.scheduler.retry_after())
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
 
             try:
-                output = self.asr_system.transcribeAudioFile("tmp/input.wav",splitterType=splitter_type,width=width)
+                # Segmentation stops at the deadline; the recognizer and lexical model get request_timeout more
+                output = future.result(timeout=max(deadline - time.monotonic(), 0) + self.request_timeout)
                 return jsonify({'transcription': output})
+            except FutureTimeoutError:
+                future.cancel()
+                return self.busy('Timed out waiting for the transcription, try again later',
+                                 self.scheduler.retry_after())
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+
+        @self.app.route('/segment', methods=['POST'])
+        def segment_text():
+            # JSON body: {"sentences": [unspaced strings], "splitterType": ..., "width": ..., "timeout": ...}
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict) or not isinstance(body.get('sentences'), list):
+                return jsonify({'error': 'Expected a JSON object with a list of sentences'}), 400
+            sentences = body['sentences']
+            if not all(isinstance(sentence, str) for sentence in sentences):
+                return jsonify({'error': 'sentences must be strings'}), 400
+            if len(sentences) > self.max_segment_sentences:
+                return jsonify({'error': f'At most {self.max_segment_sentences} sentences per call'}), 400
+            try:
+                splitter_type, width = self.splitterSettings(body)
+                deadline = self.requestDeadline(body)
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+
+            if not self.segment_slots.acquire(blocking=False):
+                return self.busy('Too many segmentation requests, try again later', self.retry_after)
+            try:
+                segmentations = self.asr_system.splitLexemesMany(sentences, splitterType=splitter_type, width=width,
+                                                                 deadline=deadline)
+                return jsonify({'segmentations': segmentations})
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+            finally:
+                self.segment_slots.release()
+
+        @self.app.route('/transcribe/stream', methods=['POST'])
+        def transcribe_audio_stream():
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file part'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No selected file'}), 400
+
+            try:
+                splitter_type, width = self.splitterSettings(request.form)
+                deadline = self.requestDeadline(request.form)
+                min_pause = float(request.form.get('minPause', 0.3))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            if not self.stream_slots.acquire(blocking=False):
+                return self.busy('Too many streaming transcriptions, try again later', self.retry_after)
+            try:
+                wav_file = self.saveFile(file)
             except Exception as e:
+                self.stream_slots.release()
                 return jsonify({'error': str(e)}), 500
 
-    def run(self, host='0.0.0.0', port=5000, debug=True):
-        self.app.run(host=host, port=port, debug=debug)
+            # Server-sent events, one per utterance, in order
+            def events():
+                try:
+                    chunks = self.asr_system.transcribeAudioFileStream(wav_file, splitterType=splitter_type,
+                                                                       width=width, min_pause=min_pause,
+                                                                       deadline=deadline)
+                    for index, text in enumerate(chunks):
+                        yield f"data: {json.dumps({'index': index, 'transcription': text}, ensure_ascii=False)}\n\n"
+                    yield "event: done\ndata: {}\n\n"
+                except Exception as e:
+                    yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+            response = Response(stream_with_context(events()), mimetype='text/event-stream')
+            # Released when the response is closed, whether or not the client read the whole stream
+            response.call_on_close(self.stream_slots.release)
+            return response
+
+    def start_segment_pool(self):
+        """
+        Forks the processes /segment uses. Call it before any request is served, while this process has
+        no threads, see SentenceSplitter.start_pool.
+        """
+        self.asr_system.splitter.start_pool(self.segment_workers)
+
+    def run(self, host='0.0.0.0', port=5000, debug=True, threaded=True):
+        self.start_segment_pool()
+        self.app.run(host=host, port=port, debug=debug, threaded=threaded)
 
 if __name__ == '__main__':
-    server = ASRServer()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--batch-window-ms', type=float, default=20)
+    parser.add_argument('--max-queue-depth', type=int, default=64)
+    parser.add_argument('--job-workers', type=int, default=2)
+    parser.add_argument('--max-queued-jobs', type=int, default=32)
+    parser.add_argument('--job-ttl', type=float, default=3600)
+    parser.add_argument('--job-timeout', type=float, default=300,
+                        help="seconds a job may spend segmenting before it finishes greedily")
+    parser.add_argument('--job-dir', default=None,
+                        help="directory of the job states, shared by every server process (default: a temporary one)")
+    parser.add_argument('--cache-memory-mb', type=float, default=64)
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--max-ffmpeg-processes', type=int, default=2,
+                        help="compressed uploads decoded by ffmpeg at the same time")
+    parser.add_argument('--max-width', type=int, default=32, help="largest beam search width accepted")
+    parser.add_argument('--max-depth', type=int, default=6, help="largest best first depth accepted")
+    parser.add_argument('--request-timeout', type=float, default=30,
+                        help="seconds a request may spend segmenting before it finishes greedily")
+    parser.add_argument('--max-streams', type=int, default=4, help="streaming transcriptions run at once")
+    parser.add_argument('--segment-workers', type=int, default=None,
+                        help="processes each /segment call uses (default: one per core)")
+    parser.add_argument('--max-segment-sentences', type=int, default=10000)
+    parser.add_argument('--lexical-model-dir', default='lexical-model/model_ct2',
+                        help="CTranslate2 model directory, for Transformer lexical models")
+    parser.add_argument('--compute-type', default='default', help="int8 quantises the lexical model on CPU")
+    parser.add_argument('--intra-threads', type=int, default=0, help="threads per translation, 0 for automatic")
+    parser.add_argument('--beam-size', type=int, default=5)
+    parser.add_argument('--max-batch-tokens', type=int, default=0, help="0 for no limit")
+    args = parser.parse_args()
+    server = ASRServer(max_batch_size=args.max_batch_size, batch_window_ms=args.batch_window_ms,
+                       max_queue_depth=args.max_queue_depth, job_workers=args.job_workers,
+                       max_queued_jobs=args.max_queued_jobs, job_ttl=args.job_ttl, job_timeout=args.job_timeout,
+                       job_dir=args.job_dir, cache_memory_mb=args.cache_memory_mb, cache_dir=args.cache_dir,
+                       max_ffmpeg_processes=args.max_ffmpeg_processes, max_width=args.max_width,
+                       max_depth=args.max_depth, request_timeout=args.request_timeout,
+                       max_streams=args.max_streams, segment_workers=args.segment_workers,
+                       max_segment_sentences=args.max_segment_sentences,
+                       lexical_model_options={'converted_model_path': args.lexical_model_dir,
+                                              'compute_type': args.compute_type,
+                                              'intra_threads': args.intra_threads, 'beam_size': args.beam_size,
+                                              'max_batch_tokens': args.max_batch_tokens})
     server.run()
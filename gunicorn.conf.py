@@ -0,0 +1,28 @@
+import os
+
+# Production server: gunicorn -c gunicorn.conf.py wsgi:app
+# kill -HUP <master pid> replaces the workers gracefully, forking them again from the warm master.
+
+bind = os.environ.get('ASR_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('ASR_WORKERS', 2))
+threads = int(os.environ.get('ASR_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('ASR_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('ASR_GRACEFUL_TIMEOUT', 30))
+
+
+def post_fork(server, worker):
+    import wsgi
+    # Fork the /segment pool first, while this worker has no threads: the translator, the metrics writer
+    # and the request threads all start after it
+    wsgi.server.start_segment_pool()
+    wsgi.server.asr_system.warm_up()
+    wsgi.metrics.registry.start_writer()
+    server.log.info(f"Worker {worker.pid} is warm")
+
+
+def worker_exit(server, worker):
+    import wsgi
+    # The last values of a worker keep counting in /metrics after it exits
+    wsgi.metrics.registry.write_snapshot()
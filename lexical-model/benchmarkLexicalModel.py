@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIRECTORY, '../scripts'))
+
+from lexicalModel import LexicalModel
+
+SOURCE_FILE = os.path.join(SCRIPT_DIRECTORY, 'lexical-model-data/src-val.txt')
+TARGET_FILE = os.path.join(SCRIPT_DIRECTORY, 'lexical-model-data/tgt-val.txt')
+MODEL_FILE = os.path.join(SCRIPT_DIRECTORY, 'model_released.pt')
+
+
+def read_lines(path, limit=None):
+    with open(path, 'r', encoding='utf-8') as file:
+        lines = [line.strip() for line in file]
+    return lines[:limit] if limit else lines
+
+
+def characters(text):
+    # Word boundaries are dropped before segmentation, so only the characters are compared
+    return ''.join(text.split())
+
+
+def edit_distance(hypothesis, reference):
+    previous = list(range(len(reference) + 1))
+    for i, hypothesis_char in enumerate(hypothesis, 1):
+        current = [i]
+        for j, reference_char in enumerate(reference, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (hypothesis_char != reference_char)))
+        previous = current
+    return previous[-1]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def model_size(model):
+    """
+    Bytes of the converted model directory for CTranslate2, or of the serialised (possibly quantised) weights
+    for OpenNMT-py.
+    """
+    if model.backend == 'ctranslate2':
+        return directory_size(model.converted_model_path)
+    import io
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.translator.model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def benchmark(model, sources, targets, latency_sample, batch_size):
+    model.translate(sources[0])  # warm up
+
+    latencies = []
+    for source in sources[:latency_sample]:
+        start = time.perf_counter()
+        model.translate(source)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    hypotheses = []
+    for batch_start in range(0, len(sources), batch_size):
+        hypotheses.extend(model.translate_batch(sources[batch_start:batch_start + batch_size]))
+    elapsed = time.perf_counter() - start
+
+    errors = reference_length = 0
+    for hypothesis, target in zip(hypotheses, targets):
+        reference = characters(target)
+        errors += edit_distance(characters(hypothesis), reference)
+        reference_length += len(reference)
+    return {'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+            'sentences_per_second': len(sources) / elapsed,
+            'character_accuracy': 1 - errors / max(reference_length, 1),
+            'model_mb': model_size(model) / 2 ** 20}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency, throughput and character accuracy of the lexical model "
+                                                 "on src-val.txt/tgt-val.txt, fp32 against int8, with the "
+                                                 "backend LexicalModel actually loads")
+    parser.add_argument('--models', nargs='*', default=['fp32=default', 'int8=int8'],
+                        help="name=compute type; int8 quantises the model when it is loaded")
+    parser.add_argument('--backend', default='ctranslate2', choices=['ctranslate2', 'onmt'],
+                        help="ctranslate2 falls back to onmt for the RNN checkpoints it cannot convert")
+    parser.add_argument('--converted-model-dir', default='model_ct2',
+                        help="CTranslate2 model directory, converted from model_released.pt if missing")
+    parser.add_argument('--limit', type=int, default=1000, help="only use the first LIMIT sentences")
+    parser.add_argument('--latency-sample', type=int, default=200, help="sentences translated one at a time")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--beam-size', type=int, default=5)
+    parser.add_argument('--inter-threads', type=int, default=1)
+    parser.add_argument('--intra-threads', type=int, default=0)
+    parser.add_argument('--max-batch-tokens', type=int, default=0)
+    parser.add_argument('--json', default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    sources = read_lines(SOURCE_FILE, args.limit)
+    targets = read_lines(TARGET_FILE, args.limit)
+
+    results = []
+    print(f"{'model':<8}{'backend':>12}{'compute':>9}{'p50 ms':>9}{'p95 ms':>9}{'sent/s':>9}{'char acc':>10}{'MB':>8}")
+    for spec in args.models:
+        name, compute_type = spec.split('=', 1)
+        # The int8 CTranslate2 model is loaded from the fp32 directory with an int8 compute type
+        model = LexicalModel(MODEL_FILE, os.path.join(SCRIPT_DIRECTORY, args.converted_model_dir),
+                             backend=args.backend, beam_size=args.beam_size, inter_threads=args.inter_threads,
+                             intra_threads=args.intra_threads, max_batch_tokens=args.max_batch_tokens,
+                             compute_type=compute_type)
+        if model.translator is None:
+            sys.exit("The benchmark needs OpenNMT-py or ctranslate2")
+        result = dict(name=name, backend=model.backend, compute_type=compute_type,
+                      **benchmark(model, sources, targets, args.latency_sample, args.batch_size))
+        results.append(result)
+        print(f"{name:<8}{model.backend:>12}{compute_type:>9}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+              f"{result['sentences_per_second']:>9.1f}{result['character_accuracy']:>10.4f}{result['model_mb']:>8.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
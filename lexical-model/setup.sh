@@ -1,4 +1,7 @@
-rm lexical-model-data/run/vocab.*
+# Stop at the first failing step rather than running the later ones on missing files
+set -e
+
+rm -f lexical-model-data/run/vocab.*
 #change this to the path files for you nvidia/cuda installation
 export LD_LIBRARY_PATH=/usr/local/lib/python3.10/dist-packages/nvidia/cusparse/lib/:/usr/local/lib/python3.10/dist-packages/nvidia/cuda_cupti/lib/:/usr/local/lib/python3.10/dist-packages/nvidia/cuda_runtime/lib/:/usr/local/lib/python3.10/dist-packages/nvidia/cublas/lib/:/usr/local/lib/python3.10/dist-packages/nvidia/cufft/lib:/home/michaelbennie/.local/include/cudnn-linux-x86_64-8.9.2.26_cuda11-archive/lib
 
@@ -14,5 +17,10 @@ onmt_train -config lexical-model.yaml
 
 onmt_release_model --model lexical-model-data/run_default/model_step_40000.pt --output "model_released.pt"
 
+#compare the model in fp32 and quantised to int8 for CPU-only machines on the validation set
+#(run the server with --compute-type int8 to use the latter). This config trains an RNN, which the server
+#loads with OpenNMT-py; CTranslate2 only converts models trained with encoder_type/decoder_type: transformer
+python benchmarkLexicalModel.py
+
 #to do a quick test of the model you can do the below
 onmt_translate -model model_released.pt -src ./lexical-model-data/2Sent.txt -output testing.txt
@@ -0,0 +1,95 @@
+import io
+import subprocess
+import threading
+import wave
+
+import numpy as np
+
+# Decodes uploads in memory into the (samples, sample_rate) pairs phone_recognize_batch accepts. PCM WAV,
+# which is what browsers record, is parsed with the wave module and converted with NumPy. Only compressed
+# formats go through ffmpeg, and at most max_ffmpeg_processes of those run at once.
+
+DEFAULT_SAMPLE_RATE = 16000
+
+
+def decode_pcm_wav(data: bytes):
+    """
+    Returns (samples, sample_rate, channels) of a PCM WAV file, with samples as float32 in int16 scale,
+    or None if data is not a PCM WAV file.
+    """
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as wav_file:
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            sample_rate = wav_file.getframerate()
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) * 256
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32)
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        # Sign extend the 24 bit values
+        samples = ((values << 8) >> 8).astype(np.float32) / 256
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 65536
+    else:
+        return None
+    return samples, sample_rate, channels
+
+
+def downmix(samples, channels):
+    if channels == 1:
+        return samples
+    return samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+
+
+def to_int16(samples):
+    return np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+
+
+class AudioFrontend:
+    """
+    sample_rate is the recognizer's input rate, or a function returning it, called on first use. ffmpeg
+    resamples compressed uploads to it. WAV uploads keep their own rate: the recognizer resamples them with
+    a band-limited filter, where plain interpolation here would fold everything above the new Nyquist
+    frequency into the speech band.
+    """
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, max_ffmpeg_processes=2, ffmpeg_binary='ffmpeg'):
+        self._sample_rate = sample_rate
+        self.ffmpeg_binary = ffmpeg_binary
+        self.ffmpeg_slots = threading.BoundedSemaphore(max_ffmpeg_processes)
+
+    @property
+    def sample_rate(self):
+        if callable(self._sample_rate):
+            self._sample_rate = self._sample_rate()
+        return self._sample_rate
+
+    def decode(self, data: bytes):
+        """
+        Returns (int16 mono samples, sample_rate).
+        """
+        decoded = decode_pcm_wav(data)
+        if decoded is None:
+            return self.decode_with_ffmpeg(data), self.sample_rate
+        samples, sample_rate, channels = decoded
+        return to_int16(downmix(samples, channels)), sample_rate
+
+    def decode_with_ffmpeg(self, data: bytes):
+        """
+        Has ffmpeg decode, downmix and resample a compressed file through pipes, without temporary files.
+        """
+        command = [self.ffmpeg_binary, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+                   '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(self.sample_rate), 'pipe:1']
+        with self.ffmpeg_slots:
+            result = subprocess.run(command, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise ValueError(f"Could not decode audio: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return np.frombuffer(result.stdout, dtype='<i2')
@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from languageModel import CalculateProbability, SentenceSplitter
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_FILE = os.path.join(SCRIPT_DIRECTORY, '../lexical-model/lexical-model-data/tgt-val.txt')
+# The fixture is derived from REFERENCE_FILE, so it is built on first use rather than committed
+FIXTURE_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'asr-lm-fixture')
+# The fixture language model is counted from the first FIXTURE_SENTENCES reference sentences,
+# so results on the remaining sentences are not inflated by having seen them
+FIXTURE_SENTENCES = 2000
+
+
+def detokenise(line):
+    """
+    tgt-val.txt separates characters with one space and words with two.
+    """
+    return [word.replace(' ', '') for word in re.split(' {2,}', line.strip()) if word.strip()]
+
+
+def load_references(path=REFERENCE_FILE):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [words for words in (detokenise(line) for line in file) if words]
+
+
+def build_fixture(references, output_directory):
+    from calculatePrior import calculate_probabilities
+    os.makedirs(output_directory, exist_ok=True)
+    corpus_path = os.path.join(output_directory, 'corpus.txt')
+    with open(corpus_path, 'w', encoding='utf-8') as file:
+        for words in references[:FIXTURE_SENTENCES]:
+            file.write(' '.join(words) + '\n')
+    unigram_log_probs, bigram_log_probs = calculate_probabilities(corpus_path)
+    os.remove(corpus_path)
+    with open(os.path.join(output_directory, 'unigrams_log.tsv'), 'w', encoding='utf-8') as file:
+        for word, log_prob in unigram_log_probs:
+            file.write(f"{word}\t{log_prob}\n")
+    with open(os.path.join(output_directory, 'bigrams_log.tsv'), 'w', encoding='utf-8') as file:
+        for bigram, log_prob in bigram_log_probs:
+            file.write(f"{' '.join(bigram)}\t{log_prob}\n")
+
+
+def fixture_paths(reference_path=REFERENCE_FILE, rebuild=False):
+    """
+    Returns the unigram and bigram files of the fixture language model, counted from the first FIXTURE_SENTENCES
+    sentences of reference_path. They are built once into a cache directory named after a hash of the reference
+    file and of the counting and tokenizing code, so changing any of them gets a new fixture.
+    """
+    digest = hashlib.blake2b(str(FIXTURE_SENTENCES).encode(), digest_size=8)
+    # calculatePrior.py counts the fixture with the tokenizer in textNormalization.py, so both are hashed
+    for path in (reference_path, os.path.join(SCRIPT_DIRECTORY, 'calculatePrior.py'),
+                 os.path.join(SCRIPT_DIRECTORY, 'textNormalization.py')):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    directory = os.path.join(FIXTURE_CACHE_DIRECTORY, digest.hexdigest())
+    if rebuild or not os.path.exists(directory):
+        # Built next to the final directory and renamed into place, so concurrent runs never see half a fixture
+        os.makedirs(FIXTURE_CACHE_DIRECTORY, exist_ok=True)
+        build_directory = tempfile.mkdtemp(dir=FIXTURE_CACHE_DIRECTORY)
+        build_fixture(load_references(reference_path), build_directory)
+        if rebuild:
+            shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.rename(build_directory, directory)
+        except OSError:
+            # Another run renamed its build into place first
+            shutil.rmtree(build_directory, ignore_errors=True)
+    return os.path.join(directory, 'unigrams_log.tsv'), os.path.join(directory, 'bigrams_log.tsv')
+
+
+def word_spans(words):
+    spans = set()
+    position = 0
+    for word in words:
+        spans.add((position, position + len(word)))
+        position += len(word)
+    return spans
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_splitter(splitter, mode, sentence, parameter):
+    if mode == 'viterbi':
+        return splitter.viterbi_split_sentence(sentence)
+    if mode == 'best first':
+        return splitter.best_first_split_sentence(sentence, depth=parameter)
+    if mode == 'beam search':
+        return splitter.beam_search_split_sentence(sentence, width=parameter)
+    raise RuntimeError(f"Unknown splitter type: {mode}")
+
+
+def benchmark(splitter, mode, parameter, references, memory_sample):
+    """
+    Segments every reference sentence with its spaces removed and returns throughput, latency percentiles,
+    peak traced memory (over the first memory_sample sentences) and word level precision, recall and F1.
+    """
+    sentences = [''.join(words) for words in references]
+    latencies = []
+    correct = predicted = expected = 0
+    start = time.perf_counter()
+    for words, sentence in zip(references, sentences):
+        sentence_start = time.perf_counter()
+        output = run_splitter(splitter, mode, sentence, parameter)
+        latencies.append(time.perf_counter() - sentence_start)
+        predicted_spans = word_spans(output.split())
+        reference_spans = word_spans(words)
+        correct += len(predicted_spans & reference_spans)
+        predicted += len(predicted_spans)
+        expected += len(reference_spans)
+    elapsed = time.perf_counter() - start
+
+    # Measured in a separate pass, tracing would distort the timings above
+    tracemalloc.start()
+    for sentence in sentences[:memory_sample]:
+        run_splitter(splitter, mode, sentence, parameter)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    precision = correct / predicted if predicted else 0.0
+    recall = correct / expected if expected else 0.0
+    return {
+        'mode': mode,
+        'parameter': parameter,
+        'sentences': len(sentences),
+        'sentences_per_second': len(sentences) / elapsed,
+        'p50_ms': 1000 * percentile(latencies, 0.50),
+        'p95_ms': 1000 * percentile(latencies, 0.95),
+        'p99_ms': 1000 * percentile(latencies, 0.99),
+        'peak_memory_kb': peak_memory / 1024,
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Speed and accuracy of the SentenceSplitter modes on tgt-val.txt")
+    parser.add_argument('--unigrams', default=None, help="default: the fixture language model")
+    parser.add_argument('--bigrams', default=None, help="default: the fixture language model")
+    parser.add_argument('--depths', type=int, nargs='*', default=[1, 2, 3], help="best first depths to run")
+    parser.add_argument('--widths', type=int, nargs='*', default=[1, 4, 16], help="beam search widths to run")
+    parser.add_argument('--limit', type=int, default=None, help="only use the first LIMIT sentences")
+    parser.add_argument('--held-out', action='store_true',
+                        help="skip the sentences the fixture language model was counted from")
+    parser.add_argument('--memory-sample', type=int, default=200)
+    parser.add_argument('--json', default=None, help="also write the results to this file")
+    parser.add_argument('--build-fixture', action='store_true', help="rebuild the cached fixture and exit")
+    args = parser.parse_args()
+
+    if args.build_fixture:
+        print(os.path.dirname(fixture_paths(rebuild=True)[0]))
+        sys.exit()
+    if args.unigrams is None or args.bigrams is None:
+        fixture_unigrams, fixture_bigrams = fixture_paths()
+        args.unigrams = args.unigrams or fixture_unigrams
+        args.bigrams = args.bigrams or fixture_bigrams
+    references = load_references()
+    if args.held_out:
+        references = references[FIXTURE_SENTENCES:]
+    if args.limit:
+        references = references[:args.limit]
+
+    splitter = SentenceSplitter(CalculateProbability(args.unigrams, args.bigrams))
+    runs = [('viterbi', None)] + [('best first', depth) for depth in args.depths] + \
+           [('beam search', width) for width in args.widths]
+
+    results = []
+    print(f"{'mode':<12}{'param':>6}{'sent/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'peak KB':>10}{'F1':>8}")
+    for mode, parameter in runs:
+        result = benchmark(splitter, mode, parameter, references, args.memory_sample)
+        results.append(result)
+        print(f"{mode:<12}{'' if parameter is None else parameter:>6}{result['sentences_per_second']:>10.1f}"
+              f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+              f"{result['peak_memory_kb']:>10.0f}{result['f1']:>8.3f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarkSegmentation import fixture_paths
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(SCRIPT_DIRECTORY)
+# Modules that must only be imported when they are used
+HEAVY_MODULES = ['pandas', 'allosaurus', 'torch', 'ctranslate2', 'onmt']
+
+# Every step runs in a fresh interpreter, so imports cached by an earlier step do not hide a regression
+STEPS = {
+    'import languageModel': "import scripts.languageModel",
+    'import phonemicTranscription': "import scripts.phonemicTranscription",
+    'import ASR': "import ASR",
+    'import WebServer': "import WebServer",
+    'ASR()': "from ASR import ASR\n"
+             "asr = ASR(unigram_file_path={unigrams!r}, bigram_file_path={bigrams!r},"
+             " compiled_language_model_path=None, lexical_model_backend='subprocess')",
+    'first segmentation': "from ASR import ASR\n"
+                          "asr = ASR(unigram_file_path={unigrams!r}, bigram_file_path={bigrams!r},"
+                          " compiled_language_model_path=None, lexical_model_backend='subprocess')\n"
+                          "asr.splitLexemes('ಭಾರತಕೂಡಬದಲಿಸಿದೆ', splitterType='viterbi')",
+}
+
+MEASURE = '''
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+try:
+    with contextlib.redirect_stdout(io.StringIO()):
+{code}
+except ModuleNotFoundError as error:
+    print(json.dumps({{"missing_module": error.name}}))
+    sys.exit(0)
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def is_local_module(name):
+    """
+    Whether the top-level package of module name is one of this repository's own modules.
+    """
+    top_level = name.split('.')[0]
+    return any(os.path.exists(os.path.join(directory, top_level + '.py'))
+               or os.path.isdir(os.path.join(directory, top_level))
+               for directory in (REPOSITORY_DIRECTORY, SCRIPT_DIRECTORY))
+
+
+def measure(code, repeat):
+    """
+    Runs code repeat times, each in a new interpreter. Returns {"seconds": best wall time, "heavy_modules": heavy
+    modules it imported}, {"missing_module": name} when a third-party module is not installed, or {"error": the
+    last line of the traceback} for any other failure, a missing module of this repository included.
+    """
+    script = MEASURE.format(code='\n'.join('        ' + line for line in code.splitlines()), heavy=HEAVY_MODULES)
+    best, heavy = None, []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', script], cwd=REPOSITORY_DIRECTORY, capture_output=True,
+                                   text=True)
+        if completed.returncode != 0:
+            return {'error': ' '.join(completed.stderr.strip().splitlines()[-1:])}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        if 'missing_module' in result:
+            missing = result['missing_module']
+            if missing is None or is_local_module(missing):
+                return {'error': f"ModuleNotFoundError: {missing}"}
+            return {'missing_module': missing}
+        best = result['seconds'] if best is None else min(best, result['seconds'])
+        heavy = result['heavy']
+    return {'seconds': best, 'heavy_modules': heavy}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import and first-use times of the ASR modules, each in a fresh "
+                                                 "interpreter. Exits with status 1 when a step fails, imports a heavy "
+                                                 "dependency it does not use or takes longer than --max-seconds. "
+                                                 "Steps needing a third-party module that is not installed are "
+                                                 "skipped.")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per step, the fastest is reported")
+    parser.add_argument('--max-seconds', type=float, default=None, help="fail any step slower than this")
+    parser.add_argument('--steps', nargs='*', default=list(STEPS), choices=list(STEPS))
+    parser.add_argument('--json', default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    unigrams, bigrams = fixture_paths()
+    failed = False
+    results = []
+    print(f"{'step':<30}{'seconds':>10}  heavy modules loaded")
+    for step in args.steps:
+        result = measure(STEPS[step].format(unigrams=unigrams, bigrams=bigrams), args.repeat)
+        results.append({'step': step, **result})
+        if 'missing_module' in result:
+            # A third-party dependency that is not installed here (e.g. flask) skips the step
+            print(f"{step:<30}{'skipped':>10}  {result['missing_module']} is not installed")
+            continue
+        if 'error' in result:
+            failed = True
+            print(f"{step:<30}{'error':>10}  {result['error']}")
+            continue
+        seconds, heavy = result['seconds'], result['heavy_modules']
+        slow = args.max_seconds is not None and seconds > args.max_seconds
+        failed = failed or slow or bool(heavy)
+        print(f"{step:<30}{seconds:>10.3f}  {', '.join(heavy) or '-'}{'  SLOW' if slow else ''}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    sys.exit(1 if failed else 0)
@@ -1,18 +1,29 @@
+import argparse
+import heapq
+import os
+import shutil
 import sys
+import tempfile
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import math
 
+from textNormalization import tokenize
+
+
+
+def tokenize_line(line):
+    processed_line = tokenize(line)
+    return ["<start>"] + processed_line + ["<end>"]
+
+
 def calculate_probabilities(filepath):
     word_counts = Counter()
     bigram_counts = Counter()
 
     with open(filepath, 'r', encoding='utf-8') as file:
-        punctuation_chars = '.,​"\'‘”?()“-:;\\~@#$%^&*[]{}=|/<>'
-        translation_table = str.maketrans({char: ' ' for char in punctuation_chars})
-
         for line in file:
-            processed_line = line.strip().translate(translation_table).split()
-            processed_line = ["<start>"] + processed_line + ["<end>"]
+            processed_line = tokenize_line(line)
             if processed_line:
                 word_counts.update(processed_line)
                 bigrams = [(processed_line[i], processed_line[i + 1]) for i in range(len(processed_line) - 1)]
@@ -24,25 +35,209 @@ def calculate_probabilities(filepath):
     word_log_probabilities = {word: math.log((count + 1) / (total_words + vocabulary_size)) for word, count in word_counts.items()}
     bigram_log_probabilities = {bigram: math.log((count + 1) / (word_counts[bigram[0]] + vocabulary_size)) for bigram, count in bigram_counts.items()}
 
-    sorted_word_log_probs = sorted(word_log_probabilities.items(), key=lambda x: x[1], reverse=True)
-    sorted_bigram_log_probs = sorted(bigram_log_probabilities.items(), key=lambda x: x[1], reverse=True)
+    # Ties are ordered by text, as calculate_probabilities_parallel orders them
+    sorted_word_log_probs = sorted(word_log_probabilities.items(), key=lambda x: (-x[1], x[0]))
+    sorted_bigram_log_probs = sorted(bigram_log_probabilities.items(), key=lambda x: (-x[1], ' '.join(x[0])))
 
     return sorted_word_log_probs, sorted_bigram_log_probs
 
 
+# Sharded counting for corpora that do not fit in memory. Each worker counts a byte range of the corpus
+# and spills its counts to sorted run files whenever it holds more than max_entries keys. The runs are then
+# merged as sorted streams, so only the unigram vocabulary is ever held in memory by the parent.
+
+def split_into_byte_ranges(filepath, num_shards):
+    """
+    Splits the file into num_shards byte ranges that start and end on line boundaries.
+    """
+    file_size = os.path.getsize(filepath)
+    boundaries = [0]
+    with open(filepath, 'rb') as file:
+        for shard in range(1, num_shards):
+            file.seek(max(file_size * shard // num_shards, boundaries[-1]))
+            file.readline()
+            boundaries.append(min(file.tell(), file_size))
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def write_run(counts, run_path):
+    with open(run_path, 'w', encoding='utf-8') as file:
+        for key in sorted(counts):
+            file.write(f"{key}\t{counts[key]}\n")
+
+
+def read_run(run_path):
+    with open(run_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            key, count = line.rstrip('\n').split('\t')
+            yield key, int(count)
+
+
+def merge_runs(run_paths):
+    """
+    Merges sorted run files into one sorted stream of (key, total count).
+    """
+    current_key, current_count = None, 0
+    for key, count in heapq.merge(*(read_run(run_path) for run_path in run_paths)):
+        if key != current_key:
+            if current_key is not None:
+                yield current_key, current_count
+            current_key, current_count = key, 0
+        current_count += count
+    if current_key is not None:
+        yield current_key, current_count
+
+
+def count_shard(filepath, start, end, spill_dir, shard_index, max_entries):
+    """
+    Counts unigrams and bigrams in the byte range [start, end) of the corpus.
+    Returns the paths of the unigram and bigram run files it wrote.
+    """
+    word_counts = Counter()
+    bigram_counts = Counter()
+    unigram_runs, bigram_runs = [], []
+
+    def spill():
+        run_index = len(unigram_runs)
+        unigram_runs.append(os.path.join(spill_dir, f"unigrams_{shard_index}_{run_index}.tsv"))
+        bigram_runs.append(os.path.join(spill_dir, f"bigrams_{shard_index}_{run_index}.tsv"))
+        write_run(word_counts, unigram_runs[-1])
+        write_run(bigram_counts, bigram_runs[-1])
+        word_counts.clear()
+        bigram_counts.clear()
+
+    with open(filepath, 'rb') as file:
+        file.seek(start)
+        while file.tell() < end:
+            processed_line = tokenize_line(file.readline().decode('utf-8', errors='replace'))
+            word_counts.update(processed_line)
+            bigram_counts.update(f"{processed_line[i]} {processed_line[i + 1]}" for i in range(len(processed_line) - 1))
+            if len(word_counts) + len(bigram_counts) > max_entries:
+                spill()
+    if word_counts:
+        spill()
+    return unigram_runs, bigram_runs
+
+
+def external_sort_by_log_prob(items, spill_dir, max_entries):
+    """
+    Sorts (text, log_prob) pairs by descending log probability using sorted runs on disk.
+    """
+    run_paths = []
+    chunk = []
+
+    def spill():
+        chunk.sort(key=lambda item: item[1], reverse=True)
+        run_paths.append(os.path.join(spill_dir, f"sorted_{len(run_paths)}.tsv"))
+        with open(run_paths[-1], 'w', encoding='utf-8') as file:
+            for text, log_prob in chunk:
+                file.write(f"{text}\t{log_prob!r}\n")
+        chunk.clear()
+
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= max_entries:
+            spill()
+    if chunk:
+        spill()
+
+    def read_sorted(run_path):
+        with open(run_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                text, log_prob = line.rstrip('\n').split('\t')
+                yield text, float(log_prob)
+
+    return heapq.merge(*(read_sorted(run_path) for run_path in run_paths), key=lambda item: item[1], reverse=True)
+
+
+def calculate_probabilities_parallel(filepath, unigram_output_path=None, bigram_output_path=None,
+                                     binary_output_path=None, num_workers=None, max_entries=2_000_000,
+                                     spill_dir=None):
+    """
+    Multi-process, bounded-memory version of calculate_probabilities that writes its results to disk:
+    the sorted unigram and bigram TSVs when their paths are given, and/or the compiled language model
+    read by MappedCalculateProbability when binary_output_path is given.
+    """
+    num_workers = num_workers or os.cpu_count()
+    spill_dir = tempfile.mkdtemp(prefix='ngram_counts_', dir=spill_dir)
+    try:
+        byte_ranges = split_into_byte_ranges(filepath, num_workers * 4)
+        unigram_runs, bigram_runs = [], []
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(count_shard, filepath, start, end, spill_dir, shard_index, max_entries)
+                       for shard_index, (start, end) in enumerate(byte_ranges)]
+            for future in futures:
+                shard_unigram_runs, shard_bigram_runs = future.result()
+                unigram_runs += shard_unigram_runs
+                bigram_runs += shard_bigram_runs
+        print(f"Counted {len(byte_ranges)} shards into {len(bigram_runs)} runs, merging...")
+
+        word_counts = dict(merge_runs(unigram_runs))
+        total_words = sum(word_counts.values())
+        vocabulary_size = len(word_counts)
+        word_log_probs = sorted(((word, math.log((count + 1) / (total_words + vocabulary_size)))
+                                 for word, count in word_counts.items()), key=lambda x: x[1], reverse=True)
+
+        def bigram_log_probs():
+            for bigram_text, count in merge_runs(bigram_runs):
+                previous_word = bigram_text.split(' ', 1)[0]
+                yield bigram_text, math.log((count + 1) / (word_counts[previous_word] + vocabulary_size))
+
+        if unigram_output_path:
+            with open(unigram_output_path, 'w', encoding='utf-8') as file:
+                for word, log_prob in word_log_probs:
+                    file.write(f"{word}\t{log_prob}\n")
+        if bigram_output_path:
+            with open(bigram_output_path, 'w', encoding='utf-8') as file:
+                for bigram_text, log_prob in external_sort_by_log_prob(bigram_log_probs(), spill_dir, max_entries):
+                    file.write(f"{bigram_text}\t{log_prob}\n")
+        if binary_output_path:
+            from languageModel import write_language_model
+            min_log_prob_unigram, max_log_prob_bigram = -16.9, -13.46
+            write_language_model(((word, log_prob) for word, log_prob in word_log_probs
+                                  if log_prob >= min_log_prob_unigram),
+                                 ((tuple(bigram_text.split(' ')), log_prob) for bigram_text, log_prob in bigram_log_probs()
+                                  if log_prob >= max_log_prob_bigram),
+                                 binary_output_path, min_log_prob_unigram, max_log_prob_bigram,
+                                 max_entries=max_entries, spill_dir=spill_dir)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default="../data/text/combined_corpus.txt")
+    parser.add_argument('--unigrams', default='../data/text/unigrams_log.tsv')
+    parser.add_argument('--bigrams', default='../data/text/bigrams_log.tsv')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="more than 1 counts the corpus in shards with bounded memory")
+    parser.add_argument('--max-entries', type=int, default=2_000_000,
+                        help="keys a worker holds before spilling its counts to disk")
+    parser.add_argument('--spill-dir', default=None)
+    parser.add_argument('--binary', default=None,
+                        help="also write the compiled language model to this path")
+    parser.add_argument('--no-tsv', action='store_true', help="only write the compiled language model")
+    args = parser.parse_args()
+
+    if args.workers > 1 or args.binary:
+        calculate_probabilities_parallel(args.corpus,
+                                         unigram_output_path=None if args.no_tsv else args.unigrams,
+                                         bigram_output_path=None if args.no_tsv else args.bigrams,
+                                         binary_output_path=args.binary, num_workers=args.workers,
+                                         max_entries=args.max_entries, spill_dir=args.spill_dir)
+        sys.exit()
+
     # Calculate probabilities
-    unigram_log_probs, bigram_log_probs = calculate_probabilities("../data/text/combined_corpus.txt")
+    unigram_log_probs, bigram_log_probs = calculate_probabilities(args.corpus)
 
     # Save unigram probabilities
-    with open('../data/text/unigrams_log.tsv', 'w', encoding='utf-8') as file:
+    with open(args.unigrams, 'w', encoding='utf-8') as file:
         for word, log_prob in unigram_log_probs:
             file.write(f"{word}\t{log_prob}\n")
 
     # Save bigram probabilities
-    with open('../data/text/bigrams_log.tsv', 'w', encoding='utf-8') as file:
+    with open(args.bigrams, 'w', encoding='utf-8') as file:
         for bigram, log_prob in bigram_log_probs:
             bigram_text = ' '.join(bigram)  # Convert tuple to string
             file.write(f"{bigram_text}\t{log_prob}\n")
@@ -0,0 +1,17 @@
+import sys
+import time
+
+from languageModel import compile_language_model
+
+# One-time conversion of the unigram/bigram TSVs written by calculatePrior.py into the
+# memory-mapped format loaded by MappedCalculateProbability.
+if __name__ == '__main__':
+    unigram_file_path = '../data/text/unigrams_log.tsv'
+    bigram_file_path = '../data/text/bigrams_log.tsv'
+    output_path = '../data/text/language_model.bin'
+    if len(sys.argv) == 4:
+        unigram_file_path, bigram_file_path, output_path = sys.argv[1:]
+
+    start = time.time()
+    compile_language_model(unigram_file_path, bigram_file_path, output_path)
+    print(f"Compiled {unigram_file_path} and {bigram_file_path} into {output_path} in {time.time() - start:.1f}s")
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from phonemicTranscription import get_recognizer, phone_recognize_batch
+
+# Phoneme extraction for the whole audio corpus. Each worker process loads the allosaurus model once when it
+# starts and then recognizes batches of files. Results are appended to large shard files
+# (filename, phonemes, time differences per row) and every finished or failed file is recorded in
+# manifest.jsonl, which is what makes a rerun resume exactly where the last one stopped.
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def init_worker(num_workers):
+    import torch
+    # Every worker would otherwise start one intra-op thread per core, num_workers times more threads than cores
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
+    get_recognizer()
+
+
+def recognize_batch(audio_paths):
+    """
+    Returns (path, phonemes, time_diffs, error) for each path. When the batch fails as a whole,
+    the files are retried one at a time so a single bad file does not fail its neighbours.
+    """
+    try:
+        batch_phones = phone_recognize_batch(audio_paths)
+    except Exception:
+        batch_phones = None
+    results = []
+    for index, audio_path in enumerate(audio_paths):
+        try:
+            phones = batch_phones[index] if batch_phones is not None else phone_recognize_batch([audio_path])[0]
+            results.append((audio_path, phones.labels, phones.time_diffs().tolist(), None))
+        except Exception as e:
+            results.append((audio_path, None, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def read_manifest(output_dir):
+    """
+    Returns {path: latest manifest entry} and {path: number of failed attempts}.
+    """
+    entries, failures = {}, {}
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash
+                entries[entry['file']] = entry
+                if entry['status'] == 'failed':
+                    failures[entry['file']] = failures.get(entry['file'], 0) + 1
+    return entries, failures
+
+
+def read_shards(output_dir):
+    """
+    Yields (filename, phonemes, time_diffs) for every file the manifest marks as done, reading each row
+    from the shard the manifest points at, so rows left behind by an interrupted run are ignored.
+    """
+    entries, _ = read_manifest(output_dir)
+    done = {(os.path.basename(entry['file'])[:-4], entry['shard']) for entry in entries.values() if entry['status'] == 'done'}
+    for shard in sorted({shard for _, shard in done}):
+        with open(os.path.join(output_dir, shard), 'r', encoding='utf-8') as file:
+            for line in file:
+                filename, phonemes, time_diffs = line.rstrip('\n').split('\t')
+                if (filename, shard) in done:
+                    yield filename, phonemes.split(), [float(value) for value in time_diffs.split()]
+
+
+class ShardWriter:
+    def __init__(self, output_dir, rows_per_shard):
+        self.output_dir = output_dir
+        self.rows_per_shard = rows_per_shard
+        existing = [name for name in os.listdir(output_dir) if name.startswith('shard_')]
+        self.next_index = len(existing)
+        self.file = None
+        self.name = None
+        self.rows = 0
+
+    def write(self, audio_path, phonemes, time_diffs):
+        if self.file is None or self.rows >= self.rows_per_shard:
+            self.close()
+            self.name = f"shard_{self.next_index:05d}.tsv"
+            self.next_index += 1
+            self.file = open(os.path.join(self.output_dir, self.name), 'w', encoding='utf-8')
+            self.rows = 0
+        self.file.write(f"{os.path.basename(audio_path)[:-4]}\t{' '.join(phonemes)}\t"
+                        f"{' '.join(repr(value) for value in time_diffs)}\n")
+        self.rows += 1
+        return self.name
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def extract_corpus(folders, output_dir, num_workers=None, batch_size=32, rows_per_shard=50000, max_retries=2):
+    os.makedirs(output_dir, exist_ok=True)
+    entries, failures = read_manifest(output_dir)
+
+    audio_files = sorted(os.path.join(folder, name) for folder in folders for name in os.listdir(folder)
+                         if name.endswith('.wav'))
+    to_process = [path for path in audio_files
+                  if entries.get(path, {}).get('status') != 'done' and failures.get(path, 0) <= max_retries]
+    skipped = len(audio_files) - len(to_process)
+    print(f"{len(audio_files)} files, {skipped} already done or out of retries, {len(to_process)} to process")
+    if not to_process:
+        return
+
+    num_workers = num_workers or os.cpu_count()
+    batches = [to_process[i:i + batch_size] for i in range(0, len(to_process), batch_size)]
+    writer = ShardWriter(output_dir, rows_per_shard)
+    processed = failed = 0
+    start = time.time()
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'a', encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                                initargs=(num_workers,)) as executor:
+        futures = {executor.submit(recognize_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                # The worker itself died, record the whole batch for retry
+                results = [(path, None, None, f"{type(e).__name__}: {e}") for path in futures[future]]
+
+            manifest_lines = []
+            for audio_path, phonemes, time_diffs, error in results:
+                if error is None:
+                    shard = writer.write(audio_path, phonemes, time_diffs)
+                    manifest_lines.append({'file': audio_path, 'status': 'done', 'shard': shard})
+                else:
+                    failed += 1
+                    manifest_lines.append({'file': audio_path, 'status': 'failed', 'error': error})
+            # Rows reach the disk before the manifest says they are done
+            writer.flush()
+            manifest.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in manifest_lines)
+            manifest.flush()
+
+            processed += len(results)
+            elapsed = time.time() - start
+            rate = processed / elapsed if elapsed else 0.0
+            eta = (len(to_process) - processed) / rate if rate else float('inf')
+            print(f"{processed}/{len(to_process)} files, {failed} failed, {rate:.1f} files/s, "
+                  f"ETA {eta / 60:.1f} min")
+    writer.close()
+    print(f"Finished in {(time.time() - start) / 60:.1f} min, {failed} files failed")
+    if failed:
+        print("Run again to retry the failed files")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folders', nargs='*', default=['../data/kn_in_male', '../data/kn_in_female',
+                                                       '../data/mile_kannada_test/test/audio_files',
+                                                       '../data/mile_kannada_train/train/audio_files'])
+    parser.add_argument('--output', default='../data/phonemes')
+    parser.add_argument('--workers', type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--rows-per-shard', type=int, default=50000)
+    parser.add_argument('--max-retries', type=int, default=2)
+    args = parser.parse_args()
+    extract_corpus(args.folders, args.output, num_workers=args.workers, batch_size=args.batch_size,
+                   rows_per_shard=args.rows_per_shard, max_retries=args.max_retries)
@@ -1,5 +1,76 @@
+import bisect
 import csv
+import functools
+import gc
+import heapq
+import itertools
 import math
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+from array import array
+from functools import cached_property
+from collections.abc import Mapping
+
+# Layout of the compiled language model file written by compile_language_model:
+# header, uint32 string offsets, float64 unigram log probs (NaN when the word has no unigram entry),
+# uint64 bigram keys (previous id << 32 | word id, sorted), float64 bigram log probs, utf-8 string table.
+# Word ids are the ranks of the words in utf-8 byte order, so the string table is itself the lookup index.
+# The log probs are stored at full precision so paths score exactly as with the TSVs, ties included.
+LANGUAGE_MODEL_MAGIC = b'KNLM'
+LANGUAGE_MODEL_VERSION = 2
+LANGUAGE_MODEL_HEADER = struct.Struct('=4sIIIIddQQQQQ')
+# A bigram while the compiled file is written: (previous id << 32 | id, log probability)
+_BIGRAM_RECORD = struct.Struct('=Qd')
+
+KANNADA_DEPENDENT_CHARACTERS = frozenset(["್", "ಿ", "ಾ", "ು", "ೆ", "ಂ", "ೇ", "ೂ", "ೊ", "ೀ", "ೋ", "ೕ", "ೈ", "ೃ", "ೌ",
+                                          "ಃ", "ೖ"])
+
+
+class VocabularyTrie:
+    """
+    Character trie over the language model vocabulary, used by SentenceSplitter to list the words
+    that start at a position of an unspaced sentence without looking up every substring.
+    """
+    def __init__(self, words=()):
+        # Each node maps a character to its child node, and None to the word ending at that node
+        self.root = {}
+        for word in words:
+            self.insert(word)
+
+    def insert(self, word: str):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[None] = word
+
+    def __contains__(self, word: str) -> bool:
+        node = self.root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return False
+        return None in node
+
+    def words_at(self, text: str, start: int, max_length: int) -> list:
+        """
+        Returns (end, word) for every vocabulary word text[start:end] of at most max_length characters,
+        shortest first.
+        """
+        words = []
+        node = self.root
+        for end in range(start + 1, min(len(text), start + max_length) + 1):
+            node = node.get(text[end - 1])
+            if node is None:
+                break
+            word = node.get(None)
+            if word is not None:
+                words.append((end, word))
+        return words
 
 
 class CalculateProbability:
@@ -11,42 +82,42 @@ class CalculateProbability:
         self.unigram_probabilities = self.load_unigram_probabilities()
         self.bigram_probabilities = self.load_bigram_probabilities()
         self.average_word_length=10
+        self.vocabulary_trie
+
+    @cached_property
+    def vocabulary_trie(self) -> VocabularyTrie:
+        # Every word that has a unigram or takes part in a bigram. Any other word is out of vocabulary
+        # and its bigram log probability is oov_bigram_log_prob whatever the previous word is.
+        return VocabularyTrie(self.vocabulary())
+
+    def vocabulary(self):
+        words = set(self.unigram_probabilities)
+        for previous_word, word in self.bigram_probabilities:
+            words.add(previous_word)
+            words.add(word)
+        return words
+
+    def oov_unigram_log_prob(self, word: str) -> float:
+        if word in KANNADA_DEPENDENT_CHARACTERS:
+            return -100.0
+        return self.min_log_prob_unigram*2
+
+    def oov_bigram_log_prob(self, word: str) -> float:
+        return self.oov_unigram_log_prob(word)*2.5
 
     def load_unigram_probabilities(self):
-        unigram_probabilities = {}
-        with open(self.unigram_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file, delimiter='\t')
-            for row in reader:
-                unigram, log_prob = row[0], float(row[1])
-                if log_prob >= self.min_log_prob_unigram:
-                    unigram_probabilities[unigram] = log_prob
-                else:
-                    break
-        return unigram_probabilities
+        return dict(_read_probability_file(self.unigram_file_path, self.min_log_prob_unigram))
 
     def load_bigram_probabilities(self):
-        bigram_probabilities = {}
-        with open(self.bigram_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file, delimiter='\t')
-            for row in reader:
-                bigram_text, log_prob = row[0], float(row[1])
-                if log_prob >= self.max_log_prob_bigram:
-                    # Convert bigram text to a tuple of words
-                    bigram = tuple(bigram_text.split())
-                    bigram_probabilities[bigram] = log_prob
-                else:
-                    break
-        return bigram_probabilities
+        # Convert bigram text to a tuple of words
+        return {tuple(bigram_text.split()): log_prob
+                for bigram_text, log_prob in _read_probability_file(self.bigram_file_path, self.max_log_prob_bigram)}
 
     def calculate_unigram_probability(self, word:str):
         if word in self.unigram_probabilities:
             return self.unigram_probabilities[word]
         else:
-            kannada_dependent_characters = ["್", "ಿ", "ಾ", "ು", "ೆ", "ಂ", "ೇ", "ೂ", "ೊ", "ೀ", "ೋ", "ೕ", "ೈ", "ೃ", "ೌ",
-                                            "ಃ", "ೖ"]
-            if word in kannada_dependent_characters:
-                return -100.0
-            return self.min_log_prob_unigram*2
+            return self.oov_unigram_log_prob(word)
 
     def calculate_bigram_probability(self, word:str, previous_word:str):
         if (previous_word,word) in self.bigram_probabilities:
@@ -55,93 +126,825 @@ class CalculateProbability:
             return self.calculate_unigram_probability(word)*2.5
 
 
+def _read_probability_file(file_path, min_log_prob):
+    # The TSVs are sorted by descending log probability, so reading stops at the first row under the cut-off
+    with open(file_path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file, delimiter='\t')
+        for row in reader:
+            text, log_prob = row[0], float(row[1])
+            if log_prob < min_log_prob:
+                break
+            yield text, log_prob
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _read_bigram_records(path, records_per_read=65536):
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(records_per_read * _BIGRAM_RECORD.size)
+            if not data:
+                return
+            yield from _BIGRAM_RECORD.iter_unpack(data)
+
+
+def write_language_model(unigram_log_probs, bigram_log_probs, output_path,
+                         min_log_prob_unigram=-16.9, max_log_prob_bigram=-13.46, max_entries=2_000_000,
+                         spill_dir=None):
+    """
+    Writes the compiled language model file read by MappedCalculateProbability.
+    unigram_log_probs yields (word, log_prob) and bigram_log_probs yields ((previous_word, word), log_prob);
+    both are consumed once, so they can be generators over files of any size. Only the vocabulary is held
+    in memory: the bigrams are sorted in runs of max_entries records on disk, under spill_dir.
+    """
+    word_ids = {}
+
+    def intern(word):
+        word_id = word_ids.get(word)
+        if word_id is None:
+            word_id = word_ids[word] = len(word_ids)
+        return word_id
+
+    unigram_ids = array('I')
+    unigram_probs = array('d')
+    for word, log_prob in unigram_log_probs:
+        unigram_ids.append(intern(word))
+        unigram_probs.append(log_prob)
+
+    spill_path = tempfile.mkdtemp(prefix='language_model_', dir=spill_dir)
+    try:
+        # Keyed by the temporary ids until every word has been seen and given its final id
+        unsorted_path = os.path.join(spill_path, 'bigrams.bin')
+        bigram_count = 0
+        with open(unsorted_path, 'wb') as file:
+            for (previous_word, word), log_prob in bigram_log_probs:
+                file.write(_BIGRAM_RECORD.pack(intern(previous_word) << 32 | intern(word), log_prob))
+                bigram_count += 1
+
+        # Renumber the words so that ids follow the byte order of the string table
+        encoded_words = sorted((word.encode('utf-8'), temporary_id) for word, temporary_id in word_ids.items())
+        del word_ids
+        final_ids = array('I', bytes(4 * len(encoded_words)))
+        string_offsets = array('I', [0])
+        for final_id, (encoded, temporary_id) in enumerate(encoded_words):
+            final_ids[temporary_id] = final_id
+            string_offsets.append(string_offsets[-1] + len(encoded))
+
+        word_probs = array('d', [math.nan]) * len(encoded_words)
+        for temporary_id, log_prob in zip(unigram_ids, unigram_probs):
+            word_probs[final_ids[temporary_id]] = log_prob
+
+        run_paths = []
+        records = _read_bigram_records(unsorted_path)
+        while True:
+            chunk = sorted((final_ids[key >> 32] << 32 | final_ids[key & 0xFFFFFFFF], log_prob)
+                           for key, log_prob in itertools.islice(records, max_entries))
+            if not chunk:
+                break
+            run_paths.append(os.path.join(spill_path, f"sorted_{len(run_paths)}.bin"))
+            with open(run_paths[-1], 'wb') as file:
+                for record in chunk:
+                    file.write(_BIGRAM_RECORD.pack(*record))
+        os.remove(unsorted_path)
+
+        sections = [string_offsets, word_probs]
+        section_sizes = [len(string_offsets) * 4, len(word_probs) * 8, bigram_count * 8, bigram_count * 8]
+        offsets = []
+        position = _align(LANGUAGE_MODEL_HEADER.size)
+        for size in section_sizes:
+            offsets.append(position)
+            position = _align(position + size)
+        offsets.append(position)
+
+        # The merged keys go straight into the file and the probabilities to a spill file, copied in after them
+        probs_path = os.path.join(spill_path, 'bigram_probs.bin')
+        with open(output_path, 'wb') as file, open(probs_path, 'wb') as probs_file:
+            file.write(LANGUAGE_MODEL_HEADER.pack(LANGUAGE_MODEL_MAGIC, LANGUAGE_MODEL_VERSION, len(encoded_words),
+                                                  len(unigram_ids), bigram_count, min_log_prob_unigram,
+                                                  max_log_prob_bigram, *offsets))
+            for section, offset in zip(sections, offsets):
+                file.write(bytes(offset - file.tell()))
+                section.tofile(file)
+            file.write(bytes(offsets[2] - file.tell()))
+            bigram_keys = array('Q')
+            bigram_probs = array('d')
+            for key, log_prob in heapq.merge(*(_read_bigram_records(run_path) for run_path in run_paths)):
+                bigram_keys.append(key)
+                bigram_probs.append(log_prob)
+                if len(bigram_keys) >= 65536:
+                    bigram_keys.tofile(file)
+                    bigram_probs.tofile(probs_file)
+                    del bigram_keys[:], bigram_probs[:]
+            bigram_keys.tofile(file)
+            bigram_probs.tofile(probs_file)
+
+            file.write(bytes(offsets[3] - file.tell()))
+            probs_file.close()
+            with open(probs_path, 'rb') as spilled_probs:
+                shutil.copyfileobj(spilled_probs, file)
+            file.write(bytes(offsets[-1] - file.tell()))
+            for encoded, _ in encoded_words:
+                file.write(encoded)
+    finally:
+        shutil.rmtree(spill_path, ignore_errors=True)
+
+
+def compile_language_model(unigram_file_path, bigram_file_path, output_path,
+                           min_log_prob_unigram=-16.9, max_log_prob_bigram=-13.46):
+    """
+    One-time conversion of unigrams_log.tsv and bigrams_log.tsv into the compiled format,
+    applying the same cut-offs as CalculateProbability.
+    """
+    unigrams = _read_probability_file(unigram_file_path, min_log_prob_unigram)
+    bigrams = ((tuple(bigram_text.split()), log_prob)
+               for bigram_text, log_prob in _read_probability_file(bigram_file_path, max_log_prob_bigram))
+    write_language_model(unigrams, bigrams, output_path, min_log_prob_unigram, max_log_prob_bigram)
+
+
+class _MappedUnigrams(Mapping):
+    def __init__(self, model):
+        self.model = model
+
+    def __getitem__(self, word):
+        word_id = self.model.word_id(word)
+        if word_id is None or math.isnan(self.model.word_probs[word_id]):
+            raise KeyError(word)
+        return self.model.word_probs[word_id]
+
+    def __iter__(self):
+        for word_id, log_prob in enumerate(self.model.word_probs):
+            if not math.isnan(log_prob):
+                yield self.model.word(word_id)
+
+    def __len__(self):
+        return self.model.unigram_count
+
+
+class _MappedBigrams(Mapping):
+    def __init__(self, model):
+        self.model = model
+
+    def __getitem__(self, bigram):
+        log_prob = self.model.bigram_log_prob(bigram[1], bigram[0])
+        if log_prob is None:
+            raise KeyError(bigram)
+        return log_prob
+
+    def __iter__(self):
+        for key in self.model.bigram_keys:
+            yield self.model.word(key >> 32), self.model.word(key & 0xFFFFFFFF)
+
+    def __len__(self):
+        return len(self.model.bigram_keys)
+
+
+class _MappedVocabulary:
+    """
+    The VocabularyTrie interface over the sorted string table of a MappedCalculateProbability, so the
+    vocabulary is never copied onto the heap. The words starting with a prefix are a contiguous range of
+    word ids, which is found by binary search inside the range of the prefix one character shorter.
+    Recently used ranges are cached.
+    """
+    def __init__(self, model, prefix_cache_size=65536):
+        self.model = model
+        self.prefix_range = functools.lru_cache(maxsize=prefix_cache_size)(self._find_prefix_range)
+
+    def _prefix_of(self, word_id, length) -> bytes:
+        start = self.model.strings_offset + self.model.string_offsets[word_id]
+        end = self.model.strings_offset + self.model.string_offsets[word_id + 1]
+        return self.model._mmap[start:min(end, start + length)]
+
+    def _find_prefix_range(self, prefix: str) -> tuple:
+        """
+        Returns (low, high, is_word): the words in [low, high) start with prefix, and is_word tells
+        whether prefix is itself a word, which would then be word low.
+        """
+        if len(prefix) == 1:
+            low, end = 0, len(self.model.word_probs)
+        else:
+            low, end, _ = self.prefix_range(prefix[:-1])
+        encoded = prefix.encode('utf-8')
+        length = len(encoded)
+        high = end
+        while low < high:
+            middle = (low + high) // 2
+            if self._prefix_of(middle, length) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        first, high = low, end
+        while low < high:
+            middle = (low + high) // 2
+            if self._prefix_of(middle, length) <= encoded:
+                low = middle + 1
+            else:
+                high = middle
+        string_offsets = self.model.string_offsets
+        is_word = first < low and string_offsets[first + 1] - string_offsets[first] == length
+        return first, low, is_word
+
+    def __contains__(self, word: str) -> bool:
+        return self.model.word_id(word) is not None
+
+    def words_at(self, text: str, start: int, max_length: int) -> list:
+        words = []
+        for end in range(start + 1, min(len(text), start + max_length) + 1):
+            low, high, is_word = self.prefix_range(text[start:end])
+            if low == high:
+                break
+            if is_word:
+                words.append((end, text[start:end]))
+        return words
+
+
+class MappedCalculateProbability(CalculateProbability):
+    """
+    CalculateProbability backed by a file written by compile_language_model.
+    The file is memory-mapped read-only, so loading is near instant and every process
+    that maps the same file shares its pages. Word lookups, including the vocabulary
+    prefix lookups of the splitters, search the mapped string table.
+    """
+    def __init__(self, compiled_file_path, word_cache_size=65536):
+        self.compiled_file_path = compiled_file_path
+        with open(compiled_file_path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, word_count, self.unigram_count, bigram_count, self.min_log_prob_unigram,
+         self.max_log_prob_bigram, *offsets) = LANGUAGE_MODEL_HEADER.unpack_from(self._mmap)
+        if magic != LANGUAGE_MODEL_MAGIC or version != LANGUAGE_MODEL_VERSION:
+            raise ValueError(f"{compiled_file_path} is not a version {LANGUAGE_MODEL_VERSION} compiled language model "
+                             f"for this machine, recompile it with compileLanguageModel.py")
+        buffer = memoryview(self._mmap)
+        self.string_offsets = buffer[offsets[0]:offsets[0] + 4 * (word_count + 1)].cast('I')
+        self.word_probs = buffer[offsets[1]:offsets[1] + 8 * word_count].cast('d')
+        self.bigram_keys = buffer[offsets[2]:offsets[2] + 8 * bigram_count].cast('Q')
+        self.bigram_probs = buffer[offsets[3]:offsets[3] + 8 * bigram_count].cast('d')
+        self.strings_offset = offsets[4]
+        self.word_id = functools.lru_cache(maxsize=word_cache_size)(self._find_word_id)
+        self.unigram_probabilities = _MappedUnigrams(self)
+        self.bigram_probabilities = _MappedBigrams(self)
+        self.average_word_length = 10
+
+    @cached_property
+    def vocabulary_trie(self) -> _MappedVocabulary:
+        return _MappedVocabulary(self)
+
+    def _encoded_word(self, word_id) -> bytes:
+        return self._mmap[self.strings_offset + self.string_offsets[word_id]:
+                          self.strings_offset + self.string_offsets[word_id + 1]]
+
+    def word(self, word_id) -> str:
+        return str(self._encoded_word(word_id), 'utf-8')
+
+    def vocabulary(self):
+        # The string table holds exactly the unigram and bigram words
+        return (self.word(word_id) for word_id in range(len(self.word_probs)))
+
+    def _find_word_id(self, word: str):
+        encoded = word.encode('utf-8')
+        low, high = 0, len(self.word_probs)
+        while low < high:
+            middle = (low + high) // 2
+            if self._encoded_word(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.word_probs) and self._encoded_word(low) == encoded:
+            return low
+        return None
+
+    def bigram_log_prob(self, word: str, previous_word: str):
+        previous_id = self.word_id(previous_word)
+        if previous_id is None:
+            return None
+        word_id = self.word_id(word)
+        if word_id is None:
+            return None
+        key = previous_id << 32 | word_id
+        index = bisect.bisect_left(self.bigram_keys, key)
+        if index < len(self.bigram_keys) and self.bigram_keys[index] == key:
+            return self.bigram_probs[index]
+        return None
+
+    def calculate_unigram_probability(self, word: str):
+        word_id = self.word_id(word)
+        if word_id is not None and not math.isnan(self.word_probs[word_id]):
+            return self.word_probs[word_id]
+        return self.oov_unigram_log_prob(word)
+
+    def calculate_bigram_probability(self, word: str, previous_word: str):
+        log_prob = self.bigram_log_prob(word, previous_word)
+        if log_prob is not None:
+            return log_prob
+        return self.calculate_unigram_probability(word) * 2.5
+
+
+_START = -1
+_OOV = -2
+
+SPLITTER_MODES = ("best first", "beam search", "viterbi")
+
+# The splitter of the pool this process works for, see SentenceSplitter.start_pool
+_pool_splitter = None
+
+
+def _score(hypothesis):
+    return hypothesis[0]
+
+
+def _init_pool_worker(splitter):
+    global _pool_splitter
+    # Forked workers inherit the splitter and its probability tables copy-on-write instead of receiving a
+    # pickled copy, and gc.freeze stops their collector from touching, and so copying, those pages
+    _pool_splitter = splitter
+    gc.freeze()
+
+
+def _split_chunk(chunk):
+    sentences, mode, width, deadline = chunk
+    return [_pool_splitter.split(sentence, mode, width, deadline) for sentence in sentences]
+
+
+class _DeadlineExceeded(Exception):
+    pass
+
+
+def _check_deadline(deadline):
+    # deadline is a time.monotonic() value, or None for no deadline
+    if deadline is not None and time.monotonic() >= deadline:
+        raise _DeadlineExceeded()
+
+
+def _expired(deadline) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
 def combined_length(words:list)->int:
         return len(''.join(words))
 class SentenceSplitter:
     def __init__(self, probability_calculator: CalculateProbability):
         self.probability_calculator = probability_calculator
         self.maxWordLength = 20
-
-
-    def find_largest_bigram_log_prob(self, sentence:str, previous_word:str, start_index:int, depth)->float:
-
-        if depth <= 0:
+        self.pool = None
+        self._pool_pid = None
+
+
+    def next_words(self, sentence:str, start_index:int, previous_word)->list:
+        """
+        Returns (end, word, log probability) for every word that can follow previous_word at start_index,
+        shortest first. Only vocabulary words are looked up; every other word has the same precomputed
+        out of vocabulary cost and is returned with word None. previous_word None means the previous
+        word was out of vocabulary.
+        """
+        calculator = self.probability_calculator
+        known_words = dict(calculator.vocabulary_trie.words_at(sentence, start_index, self.maxWordLength - 1))
+        candidates = []
+        for end in range(start_index + 1, min(len(sentence), start_index + self.maxWordLength - 1) + 1):
+            word = known_words.get(end)
+            if word is None:
+                log_prob = calculator.oov_bigram_log_prob(sentence[start_index:end])
+            elif previous_word is None:
+                log_prob = calculator.calculate_unigram_probability(word)*2.5
+            else:
+                log_prob = calculator.calculate_bigram_probability(word, previous_word)
+            candidates.append((end, word, log_prob))
+        return candidates
+
+    def greedy_completion(self, sentence:str, start_index:int, previous_word)->tuple:
+        """
+        Segments sentence[start_index:] by always taking the most likely next word.
+        Returns (log probability, words).
+        """
+        total_log_prob = 0.0
+        words = []
+        while start_index < len(sentence):
+            end, previous_word, log_prob = max(self.next_words(sentence, start_index, previous_word),
+                                               key=lambda candidate: candidate[2])
+            words.append(sentence[start_index:end])
+            total_log_prob += log_prob
+            start_index = end
+        return total_log_prob, words
+
+    def find_largest_bigram_log_prob(self, sentence:str, previous_word, start_index:int, depth, memo=None,
+                                     deadline=None)->float:
+        # Out of vocabulary previous words all behave the same, so results are memoised on
+        # (previous word or None, position, depth) and every state is expanded once
+        if depth <= 0 or start_index >= len(sentence):
             return 0
+        if memo is None:
+            memo = {}
+        key = (previous_word, start_index, depth)
+        if key in memo:
+            return memo[key]
+        _check_deadline(deadline)
 
         largest_probability = math.inf*-1.0
-        for i in range(1, self.maxWordLength):
-            if i+start_index > len(sentence):
-                break
-            next_word=sentence[start_index:start_index+i]
-            phrase_probability = self.probability_calculator.calculate_bigram_probability(next_word,previous_word)
-            phrase_probability+=self.find_largest_bigram_log_prob(sentence,next_word,i+start_index,depth-1)
+        for end, next_word, word_probability in self.next_words(sentence, start_index, previous_word):
+            phrase_probability = word_probability + self.find_largest_bigram_log_prob(sentence, next_word, end,
+                                                                                      depth-1, memo, deadline)
             if phrase_probability > largest_probability:
                 largest_probability = phrase_probability
+        memo[key] = largest_probability
         return largest_probability
 
-    def best_first_split_sentence(self, sentence:str, depth=2)->str:
+    def best_first_step(self, sentence:str, index:int, previous_word, depth, memo, deadline=None)->tuple:
+        largest_probability = -math.inf
+        best_end = index + 1
+        best_word = None
+        for end, word, depth_0_probability in self.next_words(sentence, index, previous_word):
+            depth_1_probability=self.find_largest_bigram_log_prob(sentence, word, end, depth-1, memo, deadline)
+            total_probability=depth_0_probability+depth_1_probability
+
+            if total_probability > largest_probability:
+                largest_probability = total_probability
+                best_end, best_word = end, word
+        return best_end, best_word
+
+    def best_first_split_sentence(self, sentence:str, depth=2, deadline=None)->str:
+        """
+        deadline is a time.monotonic() value. Once it has passed, the rest of the sentence is segmented
+        greedily, without lookahead.
+        """
         output_sentence = ""
+        memo = {}
 
-        previous_index:int=0
         index=0
-        previous_word:str="<start>"
+        previous_word="<start>"
         while index<len(sentence):
-            largest_probability = -math.inf
-            for i in range(1,self.maxWordLength):
-                word = sentence[previous_index:previous_index + i]
-                depth_0_probability=self.probability_calculator.calculate_bigram_probability(word,previous_word)
-                depth_1_probability=self.find_largest_bigram_log_prob(sentence, word, i,depth-1)
-                total_probability=depth_0_probability+depth_1_probability
-
-                if total_probability > largest_probability:
-                    largest_probability = total_probability
-                    index = previous_index + i
-            previous_word = sentence[previous_index:index]
-            output_sentence+=previous_word+" "
-
-            previous_index=index
+            try:
+                best_end, best_word = self.best_first_step(sentence, index, previous_word, depth, memo, deadline)
+            except _DeadlineExceeded:
+                depth = 1
+                best_end, best_word = self.best_first_step(sentence, index, previous_word, depth, memo)
+            output_sentence+=sentence[index:best_end]+" "
+            previous_word = best_word
+            index = best_end
 
         return output_sentence
 
 
 
-    def beam_search_split_sentence(self, sentence: str, width=4) -> str:
-        best_sentences = [(0,[])]  # Each element is a tuple: (list of words, cumulative probability)
-        best_finished_sentences = []
-
-        while best_sentences and len(best_finished_sentences) < width:
-            new_candidates = []
-            for previous_prob,words in best_sentences:
-                previous_word = words[-1] if words else "<start>"
-                previous_sentence_length = combined_length(words)
-                for i in range(1, self.maxWordLength):
-                    if previous_sentence_length + i>len(sentence):
-                        break  # Avoid going beyond sentence length
+    def beam_search_n_best(self, sentence: str, width=4, deadline=None) -> list:
+        """
+        Beam search that extends the hypotheses one word at a time, keeping the width best after every step,
+        until width of them cover the whole sentence. Hypotheses are rows of compact arrays (position,
+        last word id, score, backpointer), so extending one copies nothing. Hypotheses that reach the same
+        position with the same last word are recombined, keeping the better one.
+        Returns the finished (log probability, segmented sentence) pairs, best first.
+        If the deadline (a time.monotonic() value) passes first, returns the hypotheses finished so far, or
+        else the best unfinished one completed greedily.
+        """
+        if not sentence:
+            return []
+        word_ids = {}
+        words = []
+        # Row 0 is the empty hypothesis
+        positions = array('i', [0])
+        last_words = array('i', [_START])
+        scores = array('d', [0.0])
+        backpointers = array('i', [-1])
+
+        beam = [0]
+        finished = []
+        while beam and len(finished) < width:
+            if _expired(deadline):
+                break
+            best_extensions = {}
+            for row in beam:
+                last_word = last_words[row]
+                previous_word = "<start>" if last_word == _START else None if last_word == _OOV else words[last_word]
+                for end, word, word_probability in self.next_words(sentence, positions[row], previous_word):
+                    if word is None:
+                        word_id = _OOV
+                    else:
+                        word_id = word_ids.get(word)
+                        if word_id is None:
+                            word_id = word_ids[word] = len(words)
+                            words.append(word)
+                    score = scores[row] + word_probability
+                    key = (end, word_id)
+                    extension = best_extensions.get(key)
+                    if extension is None or score > extension[0]:
+                        best_extensions[key] = (score, row)
+
+            beam = []
+            for (end, word_id), (score, parent) in heapq.nlargest(width, best_extensions.items(),
+                                                                  key=lambda item: item[1][0]):
+                positions.append(end)
+                last_words.append(word_id)
+                scores.append(score)
+                backpointers.append(parent)
+                if end == len(sentence):
+                    finished.append(len(positions) - 1)
+                else:
+                    beam.append(len(positions) - 1)
 
-                    next_word = sentence[previous_sentence_length:previous_sentence_length + i]
-                    if not next_word:
-                        continue #if next
-                    # Calculate probability of the next word
-                    next_prob = self.probability_calculator.calculate_bigram_probability(next_word, previous_word)
-                    new_cum_prob = previous_prob + next_prob
-                    new_candidates.append((new_cum_prob,words + [next_word]))
+        def backtrace(row):
+            segmented = []
+            while backpointers[row] != -1:
+                segmented.append(sentence[positions[backpointers[row]]:positions[row]])
+                row = backpointers[row]
+            segmented.reverse()
+            return segmented
 
-            # Sort and prune to keep only the top width number of candidates
-            new_candidates.sort(key=lambda wordProbPairs: wordProbPairs[0], reverse=True)
-            best_sentences = new_candidates[0:width]
+        if not finished and beam:
+            row = max(beam, key=scores.__getitem__)
+            last_word = last_words[row]
+            previous_word = "<start>" if last_word == _START else None if last_word == _OOV else words[last_word]
+            completion_score, completion = self.greedy_completion(sentence, positions[row], previous_word)
+            return [(scores[row] + completion_score, ' '.join(backtrace(row) + completion))]
 
-            # Move completed sentences to best_finished_sentences
-            for index,candidate in enumerate(best_sentences):
-                if self.is_sentence_complete(candidate[1], sentence):
-                    best_finished_sentences.append(candidate)
-                    best_sentences.pop(index)
+        return [(scores[row], ' '.join(backtrace(row))) for row in sorted(finished, key=scores.__getitem__, reverse=True)]
 
-        best_finished_sentences.sort(key=lambda x: x[1], reverse=True)
-        return ' '.join(best_finished_sentences[0][1]) if best_finished_sentences else ""
+    def beam_search_split_sentence(self, sentence: str, width=4, deadline=None) -> str:
+        best_sentences = self.beam_search_n_best(sentence, width=width, deadline=deadline)
+        return best_sentences[0][1] if best_sentences else ""
 
     def is_sentence_complete(self, words, original_sentence):
         return combined_length(words) == len(original_sentence)
 
+    def viterbi_n_best(self, sentence: str, n=1, deadline=None) -> list:
+        """
+        Exact bigram segmentation by dynamic programming over (end position, last word).
+        States ending in a vocabulary word are identified by the start of that word. All states ending in an
+        out of vocabulary word are merged into one per position, since no bigram follows such a word.
+        Every state keeps its n best partial paths.
+        Returns up to n (log probability, segmented sentence) pairs, best first.
+        If the deadline (a time.monotonic() value) passes first, the best path reaching the current position
+        is completed greedily and returned alone.
+        """
+        if not sentence:
+            return []
+        calculator = self.probability_calculator
+        sentence_length = len(sentence)
+        # chart[end][state] holds the best (score, word start, previous state, previous rank) of paths whose
+        # last word ends at end. state is the start of the last word, _START or _OOV.
+        chart = [dict() for _ in range(sentence_length + 1)]
+        chart[0][_START] = [(0.0, None, None, None)]
+
+        for start in range(sentence_length):
+            states = chart[start]
+            if not states:
+                continue
+            if _expired(deadline):
+                score, state, rank = max(((hypothesis[0], state, rank) for state, hypotheses in states.items()
+                                          for rank, hypothesis in enumerate(hypotheses)), key=_score)
+                previous_word = "<start>" if state == _START else None if state == _OOV else sentence[state:start]
+                completion_score, completion = self.greedy_completion(sentence, start, previous_word)
+                return [(score + completion_score,
+                         ' '.join(self._viterbi_backtrace(chart, sentence, start, state, rank) + completion))]
+            for state, hypotheses in states.items():
+                states[state] = heapq.nlargest(n, hypotheses, key=_score)
+
+            known_ends = set()
+            for end, word in calculator.vocabulary_trie.words_at(sentence, start, self.maxWordLength - 1):
+                known_ends.add(end)
+                candidates = chart[end].setdefault(start, [])
+                for state, hypotheses in states.items():
+                    if state == _OOV:
+                        word_probability = calculator.calculate_unigram_probability(word)*2.5
+                    else:
+                        previous_word = "<start>" if state == _START else sentence[state:start]
+                        word_probability = calculator.calculate_bigram_probability(word, previous_word)
+                    for rank, hypothesis in enumerate(hypotheses):
+                        candidates.append((hypothesis[0] + word_probability, start, state, rank))
+
+            # An out of vocabulary word costs the same after any previous word, so only the n best paths
+            # reaching this position can be extended by one
+            best = heapq.nlargest(n, ((hypothesis[0], state, rank) for state, hypotheses in states.items()
+                                      for rank, hypothesis in enumerate(hypotheses)), key=_score)
+            for end in range(start + 1, min(sentence_length, start + self.maxWordLength - 1) + 1):
+                if end in known_ends:
+                    continue
+                word_probability = calculator.oov_bigram_log_prob(sentence[start:end])
+                chart[end].setdefault(_OOV, []).extend((score + word_probability, start, state, rank)
+                                                        for score, state, rank in best)
+
+        finals = [(hypothesis[0], state, rank)
+                  for state, hypotheses in chart[sentence_length].items()
+                  for rank, hypothesis in enumerate(hypotheses)]
+        finals = heapq.nlargest(n, finals, key=_score)
+
+        return [(score, ' '.join(self._viterbi_backtrace(chart, sentence, sentence_length, state, rank)))
+                for score, state, rank in finals]
+
+    @staticmethod
+    def _viterbi_backtrace(chart, sentence, end, state, rank) -> list:
+        words = []
+        while state != _START:
+            _, word_start, previous_state, previous_rank = chart[end][state][rank]
+            words.append(sentence[word_start:end])
+            end, state, rank = word_start, previous_state, previous_rank
+        words.reverse()
+        return words
+
+    def viterbi_split_sentence(self, sentence: str, deadline=None) -> str:
+        best = self.viterbi_n_best(sentence, n=1, deadline=deadline)
+        return best[0][1] if best else ""
+
+    def split(self, sentence: str, mode="best first", width=3, deadline=None) -> str:
+        """
+        Segments sentence with one of SPLITTER_MODES. width is the depth for best first and the beam
+        width for beam search, and is ignored by viterbi.
+        """
+        if mode == "best first":
+            return self.best_first_split_sentence(sentence, depth=width, deadline=deadline)
+        if mode == "beam search":
+            return self.beam_search_split_sentence(sentence, width=width, deadline=deadline)
+        if mode == "viterbi":
+            return self.viterbi_split_sentence(sentence, deadline=deadline)
+        raise ValueError(f"Unknown splitter mode: {mode}")
+
+    def start_pool(self, processes=None):
+        """
+        Forks the worker processes split_many uses, processes of them (default: one per core). Call it
+        before the process starts any threads, since fork only copies the calling thread, and locks held by
+        the others stay locked in the workers. Does nothing on platforms without fork, or if this process
+        already has a pool.
+        """
+        if self._pool_pid == os.getpid() or 'fork' not in multiprocessing.get_all_start_methods():
+            return
+        # Build any lazily built vocabulary index before fork so the workers share it
+        self.probability_calculator.vocabulary_trie
+        self.pool = multiprocessing.get_context('fork').Pool(processes or os.cpu_count() or 1,
+                                                            initializer=_init_pool_worker, initargs=(self,))
+        self._pool_pid = os.getpid()
+
+    def close_pool(self):
+        if self._pool_pid == os.getpid():
+            self.pool.terminate()
+            self.pool.join()
+        self.pool = None
+        self._pool_pid = None
+
+    def split_many(self, sentences: list, mode="best first", width=3, deadline=None, chunk_size=64) -> list:
+        """
+        Segments every sentence (see split) and returns the results in input order. The sentences are
+        spread over the worker processes of start_pool, which share this splitter's probability tables
+        copy-on-write (a MappedCalculateProbability is shared through its memory map). Without a pool, and
+        for inputs of a single chunk, they are segmented in this process.
+        """
+        if mode not in SPLITTER_MODES:
+            raise ValueError(f"Unknown splitter mode: {mode}")
+        # A pool forked by a parent process is not this process's to use
+        if self._pool_pid != os.getpid() or len(sentences) <= chunk_size:
+            return [self.split(sentence, mode, width, deadline) for sentence in sentences]
+
+        chunks = [(sentences[start:start + chunk_size], mode, width, deadline)
+                  for start in range(0, len(sentences), chunk_size)]
+        results = self.pool.map(_split_chunk, chunks)
+        return [segmented for chunk in results for segmented in chunk]
+
+
+class StreamingSentenceSplitter:
+    """
+    Segments a sentence that arrives a few characters at a time, such as lexemes streamed out of the
+    lexical model. It runs the same dynamic programming as SentenceSplitter.viterbi_n_best with n=1,
+    extending the chart by the new end positions on every feed. A word is committed, and returned by feed,
+    once every path that can still be extended runs through it, so committed words are the ones the
+    offline Viterbi segmentation would produce. Positions are counted from the start of the sentence.
+    If no word becomes certain for window characters, the best path is committed up to half the window
+    back, which bounds memory regardless of sentence length at the cost of exactness.
+    """
+    def __init__(self, splitter: SentenceSplitter, window=200):
+        self.splitter = splitter
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        # text holds the characters from offset on; the root node is the last committed word boundary
+        self.text = ""
+        self.offset = 0
+        self.end = 0
+        self.root = (0, _START)
+        # chart[end][state] = (score, word start, previous state), as in viterbi_n_best with n=1
+        self.chart = {0: {_START: (0.0, None, None)}}
+
+    def feed(self, chars: str) -> list:
+        """
+        Appends chars to the sentence and returns the words that became certain.
+        """
+        if not chars:
+            return []
+        calculator = self.splitter.probability_calculator
+        max_length = self.splitter.maxWordLength - 1
+        old_end = self.end
+        self.text += chars
+        self.end += len(chars)
+
+        # Only words ending after old_end are new; they start at most max_length characters before it
+        for start in range(max(self.root[0], old_end - max_length + 1), self.end):
+            states = self.chart.get(start)
+            if not states:
+                continue
+            known_ends = set()
+            for end, word in calculator.vocabulary_trie.words_at(self.text, start - self.offset, max_length):
+                end += self.offset
+                known_ends.add(end)
+                if end <= old_end:
+                    continue
+                for state, (score, _, _) in states.items():
+                    if state == _OOV:
+                        word_probability = calculator.calculate_unigram_probability(word)*2.5
+                    else:
+                        previous_word = "<start>" if state == _START else self._word(state, start)
+                        word_probability = calculator.calculate_bigram_probability(word, previous_word)
+                    self._relax(end, start, score + word_probability, start, state)
+
+            best_state, (best_score, _, _) = max(states.items(), key=lambda item: item[1][0])
+            for end in range(max(start + 1, old_end + 1), min(self.end, start + max_length) + 1):
+                if end not in known_ends:
+                    word_probability = calculator.oov_bigram_log_prob(self._word(start, end))
+                    self._relax(end, _OOV, best_score + word_probability, start, best_state)
+
+        words = self._advance_root(self._common_ancestor(self._live_nodes()))
+        if self.end - self.root[0] > self.window:
+            words += self._force_commit()
+        return words
+
+    def flush(self) -> list:
+        """
+        Ends the sentence, returns the remaining words of its best segmentation and starts a new sentence.
+        """
+        words = []
+        if self.end > self.root[0]:
+            best_state = max(self.chart[self.end].items(), key=lambda item: item[1][0])[0]
+            words = self._advance_root((self.end, best_state))
+        self.reset()
+        return words
+
+    def _word(self, start, end) -> str:
+        return self.text[start - self.offset:end - self.offset]
+
+    def _relax(self, end, state, score, word_start, previous_state):
+        states = self.chart.setdefault(end, {})
+        current = states.get(state)
+        if current is None or score > current[0]:
+            states[state] = (score, word_start, previous_state)
+
+    def _parent(self, node):
+        _, word_start, previous_state = self.chart[node[0]][node[1]]
+        return word_start, previous_state
+
+    def _live_nodes(self) -> list:
+        # Nodes the next word can still start from: a word is at most maxWordLength - 1 characters long
+        first = max(self.root[0], self.end - self.splitter.maxWordLength + 2)
+        return [(position, state) for position in range(first, self.end + 1)
+                for state in self.chart.get(position, ())]
+
+    def _common_ancestor(self, nodes):
+        ancestor = nodes[0]
+        for node in nodes[1:]:
+            while node != ancestor:
+                if node[0] >= ancestor[0]:
+                    node = self._parent(node)
+                else:
+                    ancestor = self._parent(ancestor)
+        return ancestor
+
+    def _advance_root(self, node) -> list:
+        """
+        Commits the words from the root to node, which must descend from the root, and makes node the root.
+        """
+        words = []
+        ancestor = node
+        while ancestor != self.root:
+            parent = self._parent(ancestor)
+            words.append(self._word(parent[0], ancestor[0]))
+            ancestor = parent
+        words.reverse()
+        if node != self.root:
+            self.root = node
+            for position in [position for position in self.chart if position < node[0]]:
+                del self.chart[position]
+            self.chart[node[0]] = {node[1]: self.chart[node[0]][node[1]]}
+            self.text = self.text[node[0] - self.offset:]
+            self.offset = node[0]
+        return words
+
+    def _force_commit(self) -> list:
+        node = max(((self.end, state) for state in self.chart[self.end]),
+                   key=lambda node: self.chart[node[0]][node[1]][0])
+        target = self.end - self.window // 2
+        while node[0] > target:
+            node = self._parent(node)
+        if node == self.root:
+            return []
+        # Drop every path that does not run through the new root
+        descends = {node: True}
+        for position in sorted(self.chart):
+            if position <= node[0]:
+                continue
+            states = self.chart[position]
+            for state in list(states):
+                parent = self._parent((position, state))
+                if parent[0] < node[0] or not descends.get(parent, False):
+                    del states[state]
+                else:
+                    descends[(position, state)] = True
+        return self._advance_root(node)
+
 
 # Example usage:
 if __name__ == '__main__':
@@ -0,0 +1,177 @@
+import os
+import subprocess
+import tempfile
+import threading
+
+
+class LexicalModel:
+    """
+    Phoneme to grapheme seq2seq model that stays loaded for the lifetime of the process.
+    Backends, each falling back to the next when it cannot load the model:
+    - 'ctranslate2' converts the OpenNMT checkpoint once to a CTranslate2 model directory next to it.
+      CTranslate2 only converts Transformer checkpoints, so the RNN trained by lexical-model.yaml falls through.
+    - 'onmt' loads the checkpoint with OpenNMT-py's translator and translates in memory.
+    - 'subprocess' runs onmt_translate for every call, the last resort when OpenNMT-py cannot be imported.
+    With lazy=True the translator is only loaded on first use, which lets a pre-forking server import
+    the model before fork and have each worker start its own translator threads afterwards.
+    quantization is applied when converting (e.g. 'int8' for the CPU model written by setup.sh), and
+    compute_type when loading, so an fp32 model directory can also be run as int8. The 'onmt' backend
+    quantises the loaded RNN to int8 with PyTorch dynamic quantisation when either of them is int8 on CPU.
+    """
+    def __init__(self, model_path='lexical-model/model_released.pt', converted_model_path='lexical-model/model_ct2',
+                 backend='ctranslate2', beam_size=5, device='cpu', inter_threads=1, lazy=False, quantization=None,
+                 compute_type='default', intra_threads=0, max_batch_tokens=0):
+        self.model_path = model_path
+        self.converted_model_path = converted_model_path
+        self.beam_size = beam_size
+        self.device = device
+        # Number of translations CTranslate2 runs at the same time
+        self.inter_threads = inter_threads
+        # Threads used by each translation, 0 lets the backend choose
+        self.intra_threads = intra_threads
+        self.quantization = quantization
+        self.compute_type = compute_type
+        # Upper bound on the source tokens translated together, 0 for no bound
+        self.max_batch_tokens = max_batch_tokens
+        self.backend = backend
+        # Translator threads do not survive fork, so a translator is only used by the process that loaded it
+        self._translator = None
+        self._translator_pid = None
+        self._translator_lock = threading.Lock()
+        # The OpenNMT-py translator keeps per-call state, so it translates one batch at a time
+        self._onmt_lock = threading.Lock()
+        if not lazy:
+            self.translator
+
+    @property
+    def translator(self):
+        if self.backend != 'subprocess' and self._translator_pid != os.getpid():
+            with self._translator_lock:
+                if self._translator_pid != os.getpid():
+                    self._translator = self.load_translator()
+                    self._translator_pid = os.getpid()
+                    if self._translator is None:
+                        self.backend = 'subprocess'
+        return self._translator
+
+    def is_loaded(self) -> bool:
+        return self.backend == 'subprocess' or self._translator_pid == os.getpid()
+
+    def convert_model(self) -> bool:
+        """
+        Converts the OpenNMT checkpoint to a CTranslate2 model directory unless it already exists.
+        When that is not possible the backend falls back to 'onmt', also for processes forked afterwards.
+        """
+        if self.backend != 'ctranslate2':
+            return False
+        try:
+            import ctranslate2
+        except ImportError:
+            print("ctranslate2 is not installed, loading the model with OpenNMT-py")
+            self.backend = 'onmt'
+            return False
+        if not os.path.exists(os.path.join(self.converted_model_path, 'model.bin')):
+            print(f"Converting {self.model_path} to {self.converted_model_path}...")
+            try:
+                ctranslate2.converters.OpenNMTPyConverter(self.model_path).convert(self.converted_model_path,
+                                                                                   quantization=self.quantization)
+            except Exception as e:
+                # Raised for the RNN checkpoints CTranslate2 does not support
+                print(f"CTranslate2 cannot convert the lexical model ({e}), loading it with OpenNMT-py")
+                self.backend = 'onmt'
+                return False
+        return True
+
+    def load_translator(self):
+        if self.convert_model():
+            import ctranslate2
+            return ctranslate2.Translator(self.converted_model_path, device=self.device,
+                                          compute_type=self.compute_type, inter_threads=self.inter_threads,
+                                          intra_threads=self.intra_threads)
+        return self.load_onmt_translator()
+
+    def load_onmt_translator(self):
+        """
+        Loads the checkpoint with OpenNMT-py's translator, which runs the RNN models CTranslate2 cannot convert.
+        """
+        try:
+            import torch
+            import onmt.opts as opts
+            from onmt.translate.translator import build_translator
+            from onmt.utils.parse import ArgumentParser
+        except ImportError:
+            print("OpenNMT-py is not installed, falling back to onmt_translate")
+            return None
+        parser = ArgumentParser()
+        opts.config_opts(parser)
+        opts.translate_opts(parser)
+        # -src is required by the parser, but the sentences are passed to translate in memory
+        opt = parser.parse_args(['-model', self.model_path, '-src', os.devnull, '-beam_size', str(self.beam_size),
+                                 '-gpu', '-1' if self.device == 'cpu' else '0'])
+        ArgumentParser.validate_translate_opts(opt)
+        if self.intra_threads:
+            torch.set_num_threads(self.intra_threads)
+        try:
+            # Predictions are returned rather than written out
+            translator = build_translator(opt, report_score=False, out_file=open(os.devnull, 'w', encoding='utf-8'))
+        except Exception as e:
+            print(f"Error loading the lexical model: {e}, falling back to onmt_translate")
+            return None
+        if self.device == 'cpu' and 'int8' in (str(self.quantization), self.compute_type.split('_')[0]):
+            # int8 weights for the LSTM and Linear layers, with activations quantised on the fly
+            torch.quantization.quantize_dynamic(translator.model, {torch.nn.LSTM, torch.nn.LSTMCell, torch.nn.GRU,
+                                                                   torch.nn.GRUCell, torch.nn.Linear},
+                                                dtype=torch.qint8, inplace=True)
+        return translator
+
+    def translate(self, input_text: str) -> str:
+        return self.translate_batch([input_text])[0]
+
+    def translate_batch(self, input_texts: list) -> list:
+        """
+        Translates space separated phoneme strings into space separated grapheme strings,
+        the same format onmt_translate writes to its output file.
+        """
+        translator = self.translator
+        if translator is None:
+            return [self.translate_with_subprocess(input_text) for input_text in input_texts]
+        if self.backend == 'onmt':
+            return self.translate_batch_with_onmt(translator, input_texts)
+        results = translator.translate_batch([input_text.split() for input_text in input_texts],
+                                             beam_size=self.beam_size, max_batch_size=self.max_batch_tokens,
+                                             batch_type='tokens')
+        return [' '.join(result.hypotheses[0]) for result in results]
+
+    def translate_batch_with_onmt(self, translator, input_texts: list) -> list:
+        if self.max_batch_tokens:
+            batch_size, batch_type = self.max_batch_tokens, 'tokens'
+        else:
+            batch_size, batch_type = len(input_texts), 'sents'
+        with self._onmt_lock:
+            _, predictions = translator.translate(src=input_texts, batch_size=batch_size, batch_type=batch_type)
+        # One list of n-best hypotheses per input, best first
+        return [hypotheses[0] for hypotheses in predictions]
+
+    def translate_with_subprocess(self, input_text: str) -> str:
+        # Every call gets its own directory so concurrent requests never share files
+        with tempfile.TemporaryDirectory(prefix='onmt_') as directory:
+            phoneme_file_location = os.path.join(directory, 'phonemes.txt')
+            lexical_file_location = os.path.join(directory, 'lexicon.txt')
+            #Write the input text to the source file
+            with open(phoneme_file_location, 'w') as source_file:
+                source_file.write(input_text)
+            #run command to transcribe the phonenemes
+            command = ['onmt_translate', '-model', self.model_path, '-src', phoneme_file_location,
+                       '-output', lexical_file_location, '-beam_size', str(self.beam_size)]
+            try:
+                subprocess.run(command, check=True)
+            except subprocess.CalledProcessError as e:
+                print(f"Error during translation: {e}")
+                return None
+            #try to read the result
+            try:
+                with open(lexical_file_location, 'r') as output_file:
+                    return output_file.read()
+            except FileNotFoundError:
+                print("Output file not found.")
+                return None
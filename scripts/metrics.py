@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+import time
+import uuid
+import wave
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def with_values(self, values):
+        merged = Counter(self.name, self.documentation, self.label_names)
+        merged.values = values
+        return merged
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values -> [bucket counts..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), list(state)] for key, state in self.values.items()]
+
+    def with_values(self, values):
+        merged = Histogram(self.name, self.documentation, self.label_names, self.buckets[:-1])
+        merged.values = values
+        return merged
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Metric whose values are read when scraped. function returns {label values tuple: value}.
+    """
+    def __init__(self, name, documentation, metric_type, function, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.function = function
+        self.label_names = tuple(label_names)
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.function().items()]
+
+    def with_values(self, values):
+        return CallbackMetric(self.name, self.documentation, self.metric_type, lambda: values, self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for key, value in sorted(self.function().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    Metrics of one process. After share(directory), each process that calls start_writer() also writes its
+    values under directory, and render() reports the sum over all of them, as for the workers of a
+    pre-forking server. Counters and histograms add up every process that ever wrote, so they keep counting
+    across worker restarts, while gauges only add up the processes still running.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.directory = None
+        self.interval = 1.0
+        self._snapshot_file = None
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def callback(self, name, documentation, metric_type, function, label_names=()):
+        # Replaced on re-registration so the newest owner of the values is scraped
+        metric = CallbackMetric(name, documentation, metric_type, function, label_names)
+        with self.lock:
+            self.metrics[name] = metric
+        return metric
+
+    def share(self, directory, interval=1.0):
+        """
+        Sets the directory (local to this host) where the processes that call start_writer() write their values.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+
+    def start_writer(self):
+        """
+        Starts writing this process's values to the shared directory every interval seconds, and makes
+        render() report the sum over every process that writes there. Call it once in each forked worker.
+        """
+        if self.directory is None:
+            return
+        with self.lock:
+            metrics = list(self.metrics.values())
+        # Values copied from the parent by fork are the parent's, not this process's
+        for metric in metrics:
+            if not isinstance(metric, CallbackMetric):
+                with metric.lock:
+                    metric.values = {}
+        # The pid is for telling running processes apart, the suffix keeps a reused pid from overwriting a file
+        self._snapshot_file = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        self.write_snapshot()
+        threading.Thread(target=self._write_periodically, name='metrics-writer', daemon=True).start()
+
+    def _write_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        if self._snapshot_file is None:
+            return
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snapshot = {metric.name: metric.snapshot() for metric in metrics}
+        # Write to a private file first so readers never see a partial snapshot
+        temporary_path = f"{self._snapshot_file}.{threading.get_ident()}"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary_path, self._snapshot_file)
+
+    def _read_snapshots(self):
+        snapshots = []
+        for name in os.listdir(self.directory):
+            stem, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as file:
+                    snapshot = json.load(file)
+            except (FileNotFoundError, ValueError):
+                continue
+            snapshots.append((_is_running(int(stem.split('-')[0])), snapshot))
+        return snapshots
+
+    def _merge(self, metrics):
+        self.write_snapshot()
+        snapshots = self._read_snapshots()
+        merged = []
+        for metric in metrics:
+            gauge = getattr(metric, 'metric_type', None) == 'gauge'
+            totals = {}
+            for running, snapshot in snapshots:
+                if gauge and not running:
+                    continue
+                for key, value in snapshot.get(metric.name, ()):
+                    key = tuple(key)
+                    total = totals.get(key)
+                    if total is None:
+                        totals[key] = value
+                    elif isinstance(value, list):
+                        totals[key] = [a + b for a, b in zip(total, value)]
+                    else:
+                        totals[key] = total + value
+            merged.append(metric.with_values(totals))
+        return merged
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format, summed over the sharing processes after
+        start_writer().
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        if self._snapshot_file is not None:
+            metrics = self._merge(metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+# Process wide registry shared by ASR and the web server
+registry = MetricsRegistry()
+stage_seconds = registry.histogram('asr_stage_seconds', "Time spent in each stage of the ASR pipeline.", ['stage'])
+stage_errors = registry.counter('asr_stage_errors_total', "Stages of the ASR pipeline that raised an error.", ['stage'])
+audio_seconds = registry.histogram('asr_audio_duration_seconds', "Duration of the transcribed recordings.",
+                                   buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+phoneme_count = registry.histogram('asr_phoneme_count', "Number of phonemes recognized per recording.",
+                                   buckets=(10, 25, 50, 100, 200, 400, 800, 1600))
+lexeme_length = registry.histogram('asr_lexeme_length', "Characters produced by the lexical model per recording.",
+                                   buckets=(10, 25, 50, 100, 200, 400, 800, 1600))
+
+
+@contextmanager
+def timed(stage, record=None):
+    """
+    Times the enclosed block into asr_stage_seconds, counts it in asr_stage_errors_total if it raises,
+    and stores its duration under record["stages"][stage] when a record dict is given.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        stage_seconds.observe(duration, stage=stage)
+        if record is not None:
+            record.setdefault('stages', {})[stage] = round(duration, 6)
+
+
+def request_record(audio, splitter_type, width):
+    """
+    Starts the per request record of the audio, phoneme and lexeme sizes and the time spent in each stage,
+    and observes the duration of the audio. Stages are added with timed(stage, record).
+    """
+    record = {"splitter": splitter_type, "width": width, "stages": {}}
+    record["audio_seconds"] = round(audio_duration(audio), 3)
+    audio_seconds.observe(record["audio_seconds"])
+    return record
+
+
+def observe_phonemes(record, phonemes):
+    record["phoneme_count"] = len(phonemes.split())
+    phoneme_count.observe(record["phoneme_count"])
+
+
+def observe_lexemes(record, lexemes):
+    record["lexeme_length"] = len(lexemes)
+    lexeme_length.observe(record["lexeme_length"])
+
+
+def audio_duration(audio):
+    """
+    Duration in seconds of a wav path or file object, or of a (samples, sample_rate) pair.
+    """
+    if isinstance(audio, tuple):
+        samples, sample_rate = audio
+        return len(samples) / sample_rate
+    position = audio.tell() if hasattr(audio, 'tell') else None
+    with wave.open(audio, 'rb') as wav_file:
+        duration = wav_file.getnframes() / wav_file.getframerate()
+    if position is not None:
+        audio.seek(position)
+    return duration
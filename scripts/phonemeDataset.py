@@ -0,0 +1,144 @@
+import csv
+import os
+
+import numpy as np
+
+# Columnar storage for the phoneme corpus. Every clip is a row of a ragged array: the phoneme ids and time
+# differences of all clips are concatenated into two flat arrays, and offsets[i]:offsets[i + 1] is the
+# slice of row i. Each array is saved as its own .npy file so a saved dataset can be memory-mapped.
+
+
+class PhonemeDataset:
+    def __init__(self, filenames, vocabulary, phoneme_ids, time_diffs, offsets, sentences=None):
+        self.filenames = list(filenames)
+        self.vocabulary = list(vocabulary)
+        self.phoneme_ids = phoneme_ids
+        self.time_diffs = time_diffs
+        self.offsets = offsets
+        # Cleaned transcript of each row, set once the dataset has been joined with the transcripts
+        self.sentences = sentences
+        self._index = None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.filenames[row], self.phoneme_ids[start:end], self.time_diffs[start:end]
+
+    def phonemes(self, row) -> list:
+        return [self.vocabulary[phoneme_id] for phoneme_id in self[row][1]]
+
+    def index(self) -> dict:
+        """
+        Maps each filename to its row.
+        """
+        if self._index is None:
+            self._index = {filename: row for row, filename in enumerate(self.filenames)}
+        return self._index
+
+    def select(self, rows, sentences=None):
+        """
+        New dataset holding the given rows in the given order, gathered without a Python loop over phonemes.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return PhonemeDataset([self.filenames[row] for row in rows], self.vocabulary, self.phoneme_ids[positions],
+                              self.time_diffs[positions], offsets, sentences)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a dataset from (filename, phoneme labels, time differences) tuples, consumed as a stream.
+        """
+        filenames = []
+        vocabulary_ids = {}
+        lengths = []
+        phoneme_chunks, time_chunks = [], []
+        for filename, phonemes, time_diffs in rows:
+            filenames.append(filename)
+            lengths.append(len(phonemes))
+            phoneme_chunks.append(np.fromiter((vocabulary_ids.setdefault(phoneme, len(vocabulary_ids))
+                                               for phoneme in phonemes), dtype=np.int32, count=len(phonemes)))
+            time_chunks.append(np.asarray(time_diffs, dtype=np.float32))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(filenames, list(vocabulary_ids),
+                   np.concatenate(phoneme_chunks) if phoneme_chunks else np.zeros(0, dtype=np.int32),
+                   np.concatenate(time_chunks) if time_chunks else np.zeros(0, dtype=np.float32), offsets)
+
+    @classmethod
+    def from_csv_folders(cls, folders):
+        """
+        Reads the per-clip Phoneme/time_diff CSVs written by phonemicTranscription.py.
+        """
+        def rows():
+            for folder_path in folders:
+                for file in sorted(os.listdir(folder_path)):
+                    if file.endswith(".csv"):
+                        with open(os.path.join(folder_path, file), 'r', encoding='utf-8', newline='') as csv_file:
+                            reader = csv.reader(csv_file)
+                            header = next(reader, None)
+                            if header is None:
+                                yield file[:-4], [], []
+                                continue
+                            phoneme_column, time_column = header.index('Phoneme'), header.index('time_diff')
+                            records = list(reader)
+                        yield (file[:-4], [record[phoneme_column] for record in records],
+                               [float(record[time_column]) for record in records])
+        return cls.from_rows(rows())
+
+    @classmethod
+    def from_shards(cls, shard_directory):
+        """
+        Reads the shard files written by extractCorpusPhonemes.py.
+        """
+        from extractCorpusPhonemes import read_shards
+        return cls.from_rows(read_shards(shard_directory))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'phoneme_ids.npy'), self.phoneme_ids)
+        np.save(os.path.join(directory, 'time_diffs.npy'), self.time_diffs)
+        np.save(os.path.join(directory, 'offsets.npy'), self.offsets)
+        with open(os.path.join(directory, 'filenames.txt'), 'w', encoding='utf-8') as file:
+            file.writelines(filename + '\n' for filename in self.filenames)
+        with open(os.path.join(directory, 'vocabulary.txt'), 'w', encoding='utf-8') as file:
+            file.writelines(phoneme + '\n' for phoneme in self.vocabulary)
+        if self.sentences is not None:
+            with open(os.path.join(directory, 'sentences.txt'), 'w', encoding='utf-8') as file:
+                file.writelines(sentence + '\n' for sentence in self.sentences)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mmap_mode = 'r' if mmap else None
+
+        def read_lines(name):
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as file:
+                return [line.rstrip('\n') for line in file]
+
+        sentences_path = os.path.join(directory, 'sentences.txt')
+        return cls(read_lines('filenames.txt'), read_lines('vocabulary.txt'),
+                   np.load(os.path.join(directory, 'phoneme_ids.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, 'time_diffs.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, 'offsets.npy'), mmap_mode=mmap_mode),
+                   read_lines('sentences.txt') if os.path.exists(sentences_path) else None)
+
+
+def join_transcripts(dataset, transcripts):
+    """
+    Keeps the rows of dataset that have a transcript, in transcript order, attaching the sentences.
+    transcripts yields (filename, sentence). The filename lookup goes through dataset.index().
+    """
+    index = dataset.index()
+    rows, sentences = [], []
+    for filename, sentence in transcripts:
+        row = index.get(filename)
+        if row is not None:
+            rows.append(row)
+            sentences.append(sentence)
+    return dataset.select(rows, sentences)
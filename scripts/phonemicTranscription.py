@@ -1,36 +1,182 @@
 import os
-import pandas as pd
-import allosaurus.app
+import threading
+import numpy as np
 from concurrent.futures import ProcessPoolExecutor
 
+# allosaurus (and with it torch) and pandas are imported where they are used, so importing this module,
+# and everything that imports it, stays fast
+
+# The allosaurus model is loaded once per process and shared by every call
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+
+def get_recognizer():
+    """
+    Returns the process wide allosaurus recognizer, loading it on first use.
+    """
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                import allosaurus.app
+                _recognizer = allosaurus.app.read_recognizer()
+    return _recognizer
+
+
+def recognizer_loaded() -> bool:
+    return _recognizer is not None
+
+
+def recognizer_sample_rate(default=16000):
+    """
+    Sample rate the recognizer's feature extractor expects.
+    """
+    config = getattr(get_recognizer().pm, 'config', None)
+    return getattr(config, 'sample_rate', default)
+
+
+# Phoneme labels are interned process wide, so recognizer output stores them as small integer ids
+_label_ids = {}
+_labels = []
+_labels_lock = threading.Lock()
+
+
+def label_id(label: str) -> int:
+    phoneme_id = _label_ids.get(label)
+    if phoneme_id is None:
+        with _labels_lock:
+            phoneme_id = _label_ids.get(label)
+            if phoneme_id is None:
+                _labels.append(label)
+                phoneme_id = _label_ids[label] = len(_labels) - 1
+    return phoneme_id
+
+
+class PhonemeTimings:
+    """
+    Recognizer output as columns: start and duration in seconds, and interned label ids.
+    to_dataframe gives the start/end/label table for callers that want pandas.
+    """
+    def __init__(self, start, duration, label_ids):
+        self.start = start
+        self.duration = duration
+        self.label_ids = label_ids
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    @property
+    def labels(self) -> list:
+        return [_labels[phoneme_id] for phoneme_id in self.label_ids]
+
+    def time_diffs(self):
+        """
+        Time between the starts of consecutive phonemes, 0 for the first.
+        """
+        return np.diff(self.start, prepend=self.start[:1]) if len(self) else self.start
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({'start': self.start, 'end': self.end, 'label': self.labels})
+
 
 #based off of https://stackoverflow.com/questions/76421767/automatic-separation-between-consonants-and-vowels-in-speech-recording
-def parse_timestamp_output(output):
+def parse_timestamp_output(output) -> PhonemeTimings:
     """
     Parses the timestamp output from the phoneme recognition model.
     """
-    records = []
-    lines = output.split('\n')
-    for line in lines:
+    starts, durations, label_ids = [], [], []
+    for line in output.split('\n'):
         if line.strip():  # Ensure the line is not empty
             tok = line.split(' ')
-            start = float(tok[0])
-            duration = float(tok[1])
-            end = start + duration
-            label = tok[2]
-            records.append(dict(start=start, end=end, label=label))
-    df = pd.DataFrame.from_records(records)
-    return df
+            starts.append(float(tok[0]))
+            durations.append(float(tok[1]))
+            label_ids.append(label_id(tok[2]))
+    return PhonemeTimings(np.array(starts, dtype=np.float64), np.array(durations, dtype=np.float64),
+                          np.array(label_ids, dtype=np.int32))
 
 
-def phone_recognize_file(path, emit=1.2, lang='kan')->pd.DataFrame:
+def phone_recognize_file(path, emit=1.2, lang='kan')->PhonemeTimings:
     """
     Recognizes phonemes from an audio file and returns them along with timestamps.
+    path can also be an in-memory file object or any other input accepted by load_audio.
     """
-    model = allosaurus.app.read_recognizer()
-    out = model.recognize(path, lang, timestamp=True, emit=emit)
-    phones = parse_timestamp_output(out)
-    return phones
+    return phone_recognize_batch([path], emit=emit, lang=lang)[0]
+
+
+def load_audio(audio):
+    """
+    Accepts a wav path or file object, an allosaurus Audio, or a (samples, sample_rate) pair.
+    """
+    from allosaurus.audio import Audio, read_audio
+    if isinstance(audio, Audio):
+        return audio
+    if isinstance(audio, tuple):
+        samples, sample_rate = audio
+        return Audio(samples, sample_rate)
+    return read_audio(audio)
+
+
+def phone_recognize_batch(audios, emit=1.2, lang='kan', batch_size=16)->list:
+    """
+    Recognizes phonemes for a list of audio inputs (see load_audio) and returns one PhonemeTimings per
+    input, in input order. Inputs are padded and run through the acoustic model together, batch_size at a time.
+    """
+    from allosaurus.am.utils import move_to_tensor
+    model = get_recognizer()
+    outputs = [None] * len(audios)
+    features = [model.pm.compute(load_audio(audio)) for audio in audios]
+    # pack_padded_sequence in the acoustic model expects lengths in decreasing order
+    order = sorted(range(len(features)), key=lambda index: features[index].shape[0], reverse=True)
+
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start:batch_start + batch_size]
+        lengths = np.array([features[index].shape[0] for index in batch], dtype=np.int32)
+        padded = np.zeros((len(batch), lengths[0], features[batch[0]].shape[1]), dtype=np.float32)
+        for row, index in enumerate(batch):
+            padded[row, :lengths[row]] = features[index]
+
+        tensor_feats, tensor_lengths = move_to_tensor([padded, lengths], model.config.device_id)
+        batch_lprobs = model.am(tensor_feats, tensor_lengths).cpu().detach().numpy()
+
+        for row, index in enumerate(batch):
+            out = model.lm.compute(batch_lprobs[row][:lengths[row]], lang, 1, emit=emit, timestamp=True)
+            outputs[index] = parse_timestamp_output(out)
+    return outputs
+
+
+def split_at_pauses(phones, min_pause=0.3, max_phonemes=200)->list:
+    """
+    Splits the output of phone_recognize_file into utterance chunks at silences.
+    A new chunk starts wherever the gap between the end of one phoneme and the start of the next
+    is at least min_pause seconds. Chunks that are still longer than max_phonemes are split again
+    at their largest internal gap, so no chunk exceeds the lengths the lexical model was trained on.
+    Returns a list of phoneme label lists.
+    """
+    labels = phones.labels
+    if not labels:
+        return []
+    starts = phones.start.tolist()
+    ends = phones.end.tolist()
+    # gaps[i] is the silence before phoneme i
+    gaps = [0.0] + [starts[i] - ends[i - 1] for i in range(1, len(labels))]
+
+    boundaries = [0] + [i for i in range(1, len(labels)) if gaps[i] >= min_pause] + [len(labels)]
+    chunks = []
+    pending = [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+    while pending:
+        start, end = pending.pop(0)
+        if end - start <= max_phonemes:
+            chunks.append((start, end))
+            continue
+        cut = max(range(start + 1, end), key=lambda i: gaps[i])
+        pending[0:0] = [(start, cut), (cut, end)]
+    return [labels[start:end] for start, end in chunks]
 
 
 def get_output_path(input_path):
@@ -68,15 +214,16 @@ def phoneme_time_diff(audio_path):
     Returns a pandas DataFrame with phonemes and the time difference.
     """
     # Recognize phonemes from the audio file
-    phones_df = phone_recognize_file(audio_path)
-
-    # Calculate time differences between consecutive phonemes
-    phones_df['time_diff'] = phones_df['start'].diff().fillna(0)
+    phones = phone_recognize_file(audio_path)
+    return add_time_diff(phones)
 
-    # Select and rename columns for the final DataFrame
-    final_df = phones_df[['label', 'time_diff']].rename(columns={'label': 'Phoneme'})
 
-    return final_df
+def add_time_diff(phones):
+    """
+    Turns the output of phone_recognize_file into the Phoneme/time_diff table stored for training.
+    """
+    import pandas as pd
+    return pd.DataFrame({'Phoneme': phones.labels, 'time_diff': phones.time_diffs()})
 
 
 def process_single_file(audio_path):
@@ -88,7 +235,17 @@ def process_single_file(audio_path):
     phoneme_time_diff_to_csv(audio_path)
 
 
-def process_folder_and_save(folder_path):
+def process_file_batch(audio_paths):
+    """
+    Recognizes a batch of files in one acoustic model pass and writes one CSV per file.
+    The recognizer is loaded once per worker process and reused for every batch it handles.
+    """
+    print(f"Processing {len(audio_paths)} files starting with {audio_paths[0]}...")
+    for audio_path, phones in zip(audio_paths, phone_recognize_batch(audio_paths)):
+        add_time_diff(phones).to_csv(get_output_path(audio_path), index=False)
+
+
+def process_folder_and_save(folder_path, batch_size=16):
     """
     Processes all audio files in the given folder in parallel, recognizes phonemes,
     calculates time differences, and saves the results in CSV files in a new folder.
@@ -125,10 +282,12 @@ def process_folder_and_save(folder_path):
     # Number of workers is usually set to the number of CPU cores available
     num_workers = 2
 
+    batches = [to_process_files[i:i + batch_size] for i in range(0, len(to_process_files), batch_size)]
+
     # Using ProcessPoolExecutor to run tasks in parallel
     with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        # map function blocks until all tasks are completed
-        executor.map(process_single_file, to_process_files)
+        # consuming the results re-raises any exception from the workers
+        list(executor.map(process_file_batch, batches))
 
     print("All files have been processed.")
 
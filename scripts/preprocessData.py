@@ -2,6 +2,9 @@ import os
 
 import pandas as pd
 
+from phonemeDataset import PhonemeDataset, join_transcripts
+from textNormalization import clean_lines, clean_text
+
 
 
 def combine_csv_files(folder_path):
@@ -110,10 +113,7 @@ def clean_sentence(sentence):
     """
     Clean the sentence by removing unwanted characters and adding start and end tokens.
     """
-    # Remove unwanted characters
-    cleaned_sentence = ''.join([char for char in sentence if
-                                char.isalnum() or char.isspace() or ord(char) in range(3200,
-                                                                                       3200 + 128) or char in ",.!?"])
+    cleaned_sentence = clean_text(sentence)
     # Split into characters and add start and end tokens
     cleaned_sentence = "<start>," + ",".join(cleaned_sentence) + ",<end>"
     return cleaned_sentence
@@ -129,14 +129,8 @@ def combine_transcript_files(file_paths, save_path):
 
     The function creates a table with 2 columns: the filename and the parsed sentence.
     """
-    data = []
-
-    for file_path in file_paths:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                filename, sentence = line.strip().split('\t')
-                cleaned_sentence = clean_sentence(sentence)
-                data.append([filename, cleaned_sentence])
+    data = [[filename, "<start>," + ",".join(cleaned_sentence) + ",<end>"]
+            for filename, cleaned_sentence in read_transcripts(file_paths)]
 
     df = pd.DataFrame(data, columns=['Filename', 'Parsed Sentence'])
 
@@ -168,7 +162,42 @@ def natural_join_transcripts_and_phonemes(transcripts_df, phonemes_df):
     return joined_df
 
 
+def read_transcripts(file_paths):
+    """
+    Yield (filename, cleaned sentence) for every line of the transcript files.
+    """
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            rows = [line.strip().split('\t') for line in file]
+        filenames = [filename for filename, _ in rows]
+        yield from zip(filenames, clean_lines(sentence for _, sentence in rows))
+
+
+def build_joined_dataset(transcript_paths, output_dir, folders=None, shard_directory=None):
+    """
+    Columnar replacement for combine_csv_files_from_folders, combine_transcript_files and
+    natural_join_transcripts_and_phonemes. The phonemes are read from the per-clip CSVs in folders or from the
+    shards written by extractCorpusPhonemes.py, joined with the transcripts and saved as a PhonemeDataset.
+    """
+    if shard_directory is not None:
+        phonemes = PhonemeDataset.from_shards(shard_directory)
+    else:
+        phonemes = PhonemeDataset.from_csv_folders(folders)
+    joined = join_transcripts(phonemes, read_transcripts(transcript_paths))
+    joined.save(output_dir)
+    return joined
+
+
 if __name__ == "__main__":
+    # Columnar pipeline: builds ../data/testTrain/joined/ in one step instead of the three TSVs below
+    # joined = build_joined_dataset(['data/line_index_female.tsv',
+    #                                'data/line_index_male.tsv',
+    #                                'data/mile_kannada_test/combined_sentences.tsv',
+    #                                'data/mile_kannada_train/combined_sentences.tsv'],
+    #                               '../data/testTrain/joined', shard_directory='../data/phonemes')
+    # print(f"Joined {len(joined)} clips.")
+    # exit()
+
     #used to create the x values
     # folders = ['./data/kn_in_female_trans',
     #            './data/kn_in_male_trans',
@@ -0,0 +1,132 @@
+import argparse
+import csv
+import hashlib
+import os
+import sys
+
+# Streams joined_data.tsv (or a joined PhonemeDataset) into train/validation/test files. A row's split depends
+# only on a hash of its filename, so reruns give the same splits and rows added to the corpus never move
+# existing rows to another split. Only one row is held in memory at a time.
+
+SPLITS = ('train', 'val', 'test')
+# prepareForyoyodyne.py's file names
+YOYODYNE_FILE_NAMES = {'train': 'train.tsv', 'val': 'validate.tsv', 'test': 'test.tsv'}
+CHARACTERS_TO_REMOVE = ["<start>", "<end>", "'", "[", "]", " "]
+
+
+def preprocess_column(column_value):
+    """
+    Same cleaning as split_dataset: strips the start/end tokens and list syntax and space-separates the items.
+    """
+    for char in CHARACTERS_TO_REMOVE:
+        column_value = column_value.replace(char, '')
+    return ' '.join(column_value.split(','))[1:-1]
+
+
+def assign_split(filename, validation_fraction, train_percent, salt=''):
+    """
+    validation_fraction of the rows go to validation, and train_percent of the rest go to train.
+    """
+    digest = hashlib.blake2b((salt + filename).encode('utf-8'), digest_size=8).digest()
+    bucket = int.from_bytes(digest, 'big') / 2 ** 64
+    if bucket < validation_fraction:
+        return 'val'
+    if (bucket - validation_fraction) / (1 - validation_fraction) < train_percent:
+        return 'train'
+    return 'test'
+
+
+def read_joined_tsv(tsv_file):
+    """
+    Yields (filename, phonemes, sentence) in the comma/list format written by preprocessData.py.
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(tsv_file, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file, delimiter='\t')
+        header = next(reader)
+        filename_column = header.index('Filename')
+        phonemes_column = header.index('Phonemes')
+        sentence_column = header.index('Parsed Sentence')
+        for row in reader:
+            yield row[filename_column], row[phonemes_column], row[sentence_column]
+
+
+def read_joined_dataset(directory):
+    """
+    Yields the rows of a PhonemeDataset saved by preprocessData.build_joined_dataset in the same format.
+    """
+    from phonemeDataset import PhonemeDataset
+    dataset = PhonemeDataset.load(directory)
+    for row, sentence in enumerate(dataset.sentences):
+        yield (dataset.filenames[row], ','.join(['<start>'] + dataset.phonemes(row) + ['<end>']),
+               "<start>," + ",".join(sentence) + ",<end>")
+
+
+class SplitWriter:
+    """
+    Writes src-<split>.txt/tgt-<split>.txt (opennmt) or train.tsv/validate.tsv/test.tsv (yoyodyne) files.
+    """
+    def __init__(self, output_dir, output_format='opennmt', buffer_size=1 << 20):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_format = output_format
+        self.files = {}
+        for split in SPLITS:
+            if output_format == 'opennmt':
+                self.files[split] = (open(os.path.join(output_dir, f'src-{split}.txt'), 'w', encoding='utf-8', buffering=buffer_size),
+                                     open(os.path.join(output_dir, f'tgt-{split}.txt'), 'w', encoding='utf-8', buffering=buffer_size))
+            elif output_format == 'yoyodyne':
+                self.files[split] = (open(os.path.join(output_dir, YOYODYNE_FILE_NAMES[split]), 'w', encoding='utf-8', buffering=buffer_size),)
+            else:
+                raise ValueError(f"Unknown output format {output_format}")
+
+    def write(self, split, phonemes, sentence):
+        files = self.files[split]
+        if self.output_format == 'opennmt':
+            files[0].write(phonemes + '\n')
+            files[1].write(sentence + '\n')
+        else:
+            files[0].write(phonemes + '\t' + sentence + '\n')
+
+    def close(self):
+        for files in self.files.values():
+            for file in files:
+                file.close()
+
+
+def stream_split(rows, output_dir, output_format='opennmt', validation_fraction=0.02, train_percent=0.8,
+                 max_phonemes_length=550, salt=''):
+    """
+    Cleans, filters and writes every row in a single pass. Returns the number of rows written per split.
+    """
+    counts = dict.fromkeys(SPLITS, 0)
+    writer = SplitWriter(output_dir, output_format)
+    try:
+        for filename, phonemes, sentence in rows:
+            phonemes = preprocess_column(phonemes)
+            sentence = preprocess_column(sentence)
+            if len(phonemes) > max_phonemes_length or len(sentence) > max_phonemes_length:
+                continue
+            split = assign_split(filename, validation_fraction, train_percent, salt)
+            writer.write(split, phonemes, sentence)
+            counts[split] += 1
+    finally:
+        writer.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic, constant-memory train/validation/test split.")
+    parser.add_argument('input', nargs='?', default='../data/testTrain/joined_data.tsv',
+                        help="joined_data.tsv or a directory saved by preprocessData.build_joined_dataset")
+    parser.add_argument('--output-dir', default='../lexical-model/lexical-model-data')
+    parser.add_argument('--format', choices=['opennmt', 'yoyodyne'], default='opennmt')
+    parser.add_argument('--validation-fraction', type=float, default=0.02)
+    parser.add_argument('--train-percent', type=float, default=0.8)
+    parser.add_argument('--max-phonemes-length', type=int, default=550)
+    parser.add_argument('--salt', default='', help="change to draw a different, still reproducible, split")
+    args = parser.parse_args()
+
+    rows = read_joined_dataset(args.input) if os.path.isdir(args.input) else read_joined_tsv(args.input)
+    counts = stream_split(rows, args.output_dir, args.format, args.validation_fraction, args.train_percent,
+                          args.max_phonemes_length, args.salt)
+    print(', '.join(f"{split}: {count}" for split, count in counts.items()))
@@ -0,0 +1,78 @@
+import re
+from itertools import islice
+
+# Normalisation shared by transcript preparation, language model counting and the server, so the text the
+# models are trained on and the text they see at inference go through the same rules. Both rule sets are
+# compiled into str.translate tables, which filter a whole line (or a whole chunk of lines) in C.
+
+KANNADA_BLOCK = range(3200, 3200 + 128)
+TRANSCRIPT_PUNCTUATION = ",.!?"
+# Characters the language model treats as word separators
+PUNCTUATION_CHARACTERS = '.,​"\'‘”?()“-:;\\~@#$%^&*[]{}=|/<>'
+
+
+class _TranscriptTable(dict):
+    """
+    Translate table keeping alphanumeric, whitespace, Kannada and ,.!? characters and deleting the rest.
+    The table is filled in lazily, since the set of alphanumeric characters spans all of Unicode.
+    """
+    def __missing__(self, ordinal):
+        char = chr(ordinal)
+        keep = char.isalnum() or char.isspace() or ordinal in KANNADA_BLOCK or char in TRANSCRIPT_PUNCTUATION
+        self[ordinal] = ordinal if keep else None
+        return self[ordinal]
+
+
+TRANSCRIPT_TABLE = _TranscriptTable()
+PUNCTUATION_TABLE = str.maketrans({char: ' ' for char in PUNCTUATION_CHARACTERS})
+WHITESPACE_TABLE = str.maketrans({char: None for char in ' \t\n\r'})
+PUNCTUATION_RUN = re.compile('([' + re.escape(PUNCTUATION_CHARACTERS) + ']+)')
+
+
+def clean_text(text: str) -> str:
+    """
+    Removes the characters that are not kept in transcripts.
+    """
+    return text.translate(TRANSCRIPT_TABLE)
+
+
+def clean_lines(lines, chunk_size=10000):
+    """
+    Yields clean_text of every line, translating chunk_size lines per call. Lines must not contain newlines.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield from clean_text('\n'.join(chunk)).split('\n')
+
+
+def tokenize(text: str) -> list:
+    """
+    Splits text into language model words, treating punctuation as whitespace.
+    """
+    return text.translate(PUNCTUATION_TABLE).split()
+
+
+def segmentation_runs(text: str) -> tuple:
+    """
+    Splits text at punctuation, the word boundaries the language model was counted with, into the runs the
+    sentence splitter segments, with whitespace removed, and the punctuation between them:
+    ([run, run, ...], [punctuation, ...]), with one more run than punctuation. Runs may be empty.
+    """
+    parts = PUNCTUATION_RUN.split(text.translate(WHITESPACE_TABLE))
+    return parts[0::2], parts[1::2]
+
+
+def join_runs(segmented_runs, punctuation) -> str:
+    """
+    Joins the segmented runs of segmentation_runs back together, keeping the punctuation after the word
+    before it.
+    """
+    text = segmented_runs[0]
+    for separator, segmented in zip(punctuation, segmented_runs[1:]):
+        text += separator
+        if segmented:
+            text += ' ' + segmented
+    return text.strip()
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import sys
+import threading
+import wave
+from collections import OrderedDict
+
+
+def content_key(*parts) -> str:
+    """
+    Hash of the given parts, used to name cache entries. Parts can be str, bytes or numbers.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def audio_key(audio) -> str:
+    """
+    Hash of the decoded samples of a wav path or file object, or of a (samples, sample_rate) pair,
+    so the same recording gets the same key whatever its file name or container metadata.
+    """
+    if isinstance(audio, tuple):
+        samples, sample_rate = audio
+        return content_key('samples', sample_rate, samples.tobytes())
+    position = audio.tell() if hasattr(audio, 'tell') else None
+    with wave.open(audio, 'rb') as wav_file:
+        key = content_key('wav', wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate(),
+                          wav_file.readframes(wav_file.getnframes()))
+    if position is not None:
+        audio.seek(position)
+    return key
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache of strings, limited to roughly max_bytes of values.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        value_size = sys.getsizeof(value)
+        if value_size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= sys.getsizeof(previous)
+            self.entries[key] = value
+            self.size += value_size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+
+
+class TranscriptionCache:
+    """
+    Two tier cache of the intermediate results of ASR, one namespace per stage
+    ("phonemes", "lexemes", "segmentation"). The memory tier is an LRU limited to max_memory_bytes,
+    the optional disk tier keeps one file per entry under disk_path and survives restarts.
+    """
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, disk_path=None):
+        self.memory = LRUCache(max_memory_bytes)
+        self.disk_path = disk_path
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+
+    def _count(self, stage, outcome):
+        with self.counters_lock:
+            stage_counters = self.counters.setdefault(stage, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+            stage_counters[outcome] += 1
+
+    def _disk_file(self, stage, key):
+        return os.path.join(self.disk_path, stage, key[:2], key)
+
+    def get(self, stage, key):
+        value = self.memory.get((stage, key))
+        if value is not None:
+            self._count(stage, 'memory_hits')
+            return value
+        if self.disk_path:
+            try:
+                with open(self._disk_file(stage, key), 'r', encoding='utf-8') as file:
+                    value = file.read()
+            except FileNotFoundError:
+                value = None
+            if value is not None:
+                self.memory.put((stage, key), value)
+                self._count(stage, 'disk_hits')
+                return value
+        self._count(stage, 'misses')
+        return None
+
+    def put(self, stage, key, value):
+        if value is None:
+            return
+        self.memory.put((stage, key), value)
+        if self.disk_path:
+            path = self._disk_file(stage, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a private file first so readers never see a partial entry
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                file.write(value)
+            os.replace(temporary_path, path)
+
+    def stats(self):
+        with self.counters_lock:
+            stats = {stage: dict(stage_counters) for stage, stage_counters in self.counters.items()}
+        stats['memory_bytes'] = self.memory.size
+        stats['memory_entries'] = len(self.memory.entries)
+        return stats
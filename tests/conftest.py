@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The server modules live at the top of the repository, and the modules in scripts/ import each other by
+# their bare names
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, 'scripts'))
+
+from benchmarkSegmentation import FIXTURE_SENTENCES, fixture_paths, load_references  # noqa: E402
+from languageModel import CalculateProbability, SentenceSplitter  # noqa: E402
+
+# Enough sentences to cover every mode's edge cases while keeping the suite quick
+SAMPLE_SENTENCES = 120
+
+
+@pytest.fixture(scope='session')
+def references():
+    return load_references()
+
+
+@pytest.fixture(scope='session')
+def fixture_model():
+    """
+    The unigram and bigram TSVs of the fixture language model, built on first use.
+    """
+    return fixture_paths()
+
+
+@pytest.fixture(scope='session')
+def sentences(references):
+    # Half counted into the fixture model and half held out
+    sample = references[FIXTURE_SENTENCES - SAMPLE_SENTENCES // 2:FIXTURE_SENTENCES + SAMPLE_SENTENCES // 2]
+    return [''.join(words) for words in sample]
+
+
+@pytest.fixture(scope='session')
+def splitter(fixture_model):
+    return SentenceSplitter(CalculateProbability(*fixture_model))
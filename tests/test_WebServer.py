@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+
+from WebServer import ASRServer, BatchScheduler, TranscriptionRequest  # noqa: E402
+
+
+class FakeASR:
+    """
+    Stands in for ASR: a recording is a (samples, sample_rate) pair, and a batch that holds an empty
+    recording fails as a whole, as a batched recognizer call does.
+    """
+    def __init__(self):
+        self.phoneme_batches = []
+
+    def generatePhonemicTranscriptions(self, recordings):
+        self.phoneme_batches.append(len(recordings))
+        if any(not samples for samples, _ in recordings):
+            raise ValueError("empty recording")
+        return [' '.join(['a'] * len(samples)) for samples, _ in recordings]
+
+    def translate_batch_with_onmt(self, phoneme_list):
+        return [phonemes.replace(' ', '') for phonemes in phoneme_list]
+
+    def splitLexemes(self, lexemes, splitterType, width, deadline):
+        return f'{splitterType} {lexemes}'
+
+
+def test_failed_batch_is_retried_per_request():
+    asr = FakeASR()
+    scheduler = BatchScheduler(asr)
+    batch = [TranscriptionRequest(([0.0] * length, 16000), 'viterbi', 3) for length in (2, 0, 3)]
+    scheduler._process(batch)
+
+    # The failed batch of three is retried one request at a time, and only the empty recording fails
+    assert asr.phoneme_batches == [3, 1, 1, 1]
+    assert batch[0].future.result() == 'viterbi aa'
+    with pytest.raises(ValueError):
+        batch[1].future.result()
+    assert batch[2].future.result() == 'viterbi aaa'
+
+
+def test_request_deadline_is_capped_and_finite():
+    server = object.__new__(ASRServer)
+    server.request_timeout = 30
+    before = time.monotonic()
+    assert before + 5 <= server.requestDeadline({'timeout': '5'}) <= time.monotonic() + 5
+    assert server.requestDeadline({'timeout': '600'}) <= time.monotonic() + 30
+    assert server.requestDeadline({'timeout': '-1'}) <= time.monotonic()
+    for timeout in ('nan', 'inf', '-inf'):
+        with pytest.raises(ValueError):
+            server.requestDeadline({'timeout': timeout})
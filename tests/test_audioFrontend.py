@@ -0,0 +1,58 @@
+import io
+import wave
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from audioFrontend import AudioFrontend, decode_pcm_wav, downmix  # noqa: E402
+
+# int16 test signal, left and right channels interleaved
+STEREO = np.array([[1000, -1000], [32767, -32768], [-200, 600], [0, 0]], dtype='<i2')
+
+
+def wav_bytes(frames: bytes, channels, sample_width, sample_rate=8000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(frames)
+    return buffer.getvalue()
+
+
+def to_width(samples, sample_width):
+    # The same int16 values scaled to sample_width bytes, as little endian PCM
+    if sample_width == 1:
+        return (samples.astype(np.int32) // 256 + 128).astype(np.uint8).tobytes()
+    values = samples.astype(np.int64) << (8 * (sample_width - 2))
+    return b''.join(int(value).to_bytes(sample_width, 'little', signed=True) for value in values.ravel())
+
+
+@pytest.mark.parametrize('sample_width', [1, 2, 3, 4])
+def test_decode_pcm_wav_scales_every_width_to_int16(sample_width):
+    samples, sample_rate, channels = decode_pcm_wav(wav_bytes(to_width(STEREO, sample_width), 2, sample_width))
+    assert (sample_rate, channels, samples.dtype) == (8000, 2, np.float32)
+    # 8 bit keeps only the high byte of each value
+    expected = STEREO.ravel() // 256 * 256 if sample_width == 1 else STEREO.ravel()
+    assert samples.tolist() == expected.astype(np.float32).tolist()
+
+
+def test_decode_pcm_wav_rejects_other_data():
+    assert decode_pcm_wav(b'ID3' + bytes(64)) is None
+    assert decode_pcm_wav(b'RIFF' + bytes(4) + b'WAVE' + bytes(8)) is None
+
+
+def test_downmix_averages_channels():
+    samples = STEREO.ravel().astype(np.float32)
+    assert downmix(samples, 1) is samples
+    assert downmix(samples, 2).tolist() == [0.0, -0.5, 200.0, 0.0]
+    # A trailing partial frame is dropped
+    assert downmix(samples[:-1], 2).tolist() == [0.0, -0.5, 200.0]
+
+
+def test_decode_returns_int16_mono_at_the_file_rate():
+    frontend = AudioFrontend(sample_rate=16000)
+    samples, sample_rate = frontend.decode(wav_bytes(STEREO.tobytes(), 2, 2, sample_rate=44100))
+    assert sample_rate == 44100
+    assert samples.dtype == np.int16 and samples.tolist() == [0, 0, 200, 0]
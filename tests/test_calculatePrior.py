@@ -0,0 +1,19 @@
+from benchmarkSegmentation import FIXTURE_SENTENCES
+from calculatePrior import calculate_probabilities_parallel
+
+
+def test_parallel_counts_match_serial(references, fixture_model, tmp_path):
+    # The fixture TSVs are written by the serial calculate_probabilities from the same sentences
+    corpus_path = tmp_path / 'corpus.txt'
+    corpus_path.write_text(''.join(' '.join(words) + '\n' for words in references[:FIXTURE_SENTENCES]),
+                           encoding='utf-8')
+    unigram_path, bigram_path = tmp_path / 'unigrams_log.tsv', tmp_path / 'bigrams_log.tsv'
+    # A small max_entries makes the workers spill and merge several runs
+    calculate_probabilities_parallel(str(corpus_path), str(unigram_path), str(bigram_path), num_workers=2,
+                                     max_entries=500, spill_dir=str(tmp_path))
+
+    serial_unigram_path, serial_bigram_path = fixture_model
+    with open(serial_unigram_path, 'rb') as file:
+        assert unigram_path.read_bytes() == file.read()
+    with open(serial_bigram_path, 'rb') as file:
+        assert bigram_path.read_bytes() == file.read()
@@ -0,0 +1,89 @@
+import random
+import time
+
+import pytest
+
+from languageModel import (SPLITTER_MODES, MappedCalculateProbability, SentenceSplitter, StreamingSentenceSplitter,
+                           _read_probability_file, compile_language_model, write_language_model)
+
+
+@pytest.fixture(scope='module')
+def mapped_model(fixture_model, tmp_path_factory):
+    compiled_path = tmp_path_factory.mktemp('compiled') / 'language_model.bin'
+    compile_language_model(*fixture_model, str(compiled_path))
+    return MappedCalculateProbability(str(compiled_path))
+
+
+def test_mapped_model_matches_tsv_model(splitter, mapped_model, sentences):
+    tsv_model = splitter.probability_calculator
+    assert sorted(mapped_model.vocabulary()) == sorted(tsv_model.unigram_probabilities)
+    for word, log_prob in tsv_model.unigram_probabilities.items():
+        assert mapped_model.calculate_unigram_probability(word) == log_prob
+    for (previous_word, word), log_prob in tsv_model.bigram_probabilities.items():
+        assert mapped_model.calculate_bigram_probability(word, previous_word) == log_prob
+    assert mapped_model.calculate_unigram_probability('ಅಲ್ಲದಪದ') == tsv_model.calculate_unigram_probability('ಅಲ್ಲದಪದ')
+
+    for sentence in sentences:
+        for start in range(len(sentence)):
+            assert (mapped_model.vocabulary_trie.words_at(sentence, start, splitter.maxWordLength - 1) ==
+                    tsv_model.vocabulary_trie.words_at(sentence, start, splitter.maxWordLength - 1))
+    mapped_splitter = SentenceSplitter(mapped_model)
+    for mode in SPLITTER_MODES:
+        assert ([mapped_splitter.split(sentence, mode) for sentence in sentences] ==
+                [splitter.split(sentence, mode) for sentence in sentences])
+
+
+def test_compiled_model_does_not_depend_on_run_size(fixture_model, mapped_model, tmp_path):
+    unigram_path, bigram_path = fixture_model
+    bigrams = ((tuple(bigram_text.split()), log_prob)
+               for bigram_text, log_prob in _read_probability_file(bigram_path, -13.46))
+    # Small runs, so the bigrams are merged from many sorted files
+    write_language_model(_read_probability_file(unigram_path, -16.9), bigrams, str(tmp_path / 'runs.bin'),
+                         max_entries=1000, spill_dir=str(tmp_path))
+    assert (tmp_path / 'runs.bin').read_bytes() == open(mapped_model.compiled_file_path, 'rb').read()
+    assert [path.name for path in tmp_path.iterdir()] == ['runs.bin']
+
+
+@pytest.mark.parametrize('mode', SPLITTER_MODES)
+def test_split_many_matches_serial(splitter, mapped_model, sentences, mode):
+    for model_splitter in (splitter, SentenceSplitter(mapped_model)):
+        serial = [model_splitter.split(sentence, mode) for sentence in sentences]
+        model_splitter.start_pool(2)
+        try:
+            pool = model_splitter.pool
+            assert model_splitter.split_many(sentences, mode, chunk_size=16) == serial
+            # Later calls reuse the same workers
+            assert model_splitter.split_many(sentences[::-1], mode, chunk_size=16) == serial[::-1]
+            assert model_splitter.pool is pool
+        finally:
+            model_splitter.close_pool()
+
+
+def test_streaming_matches_offline_viterbi(splitter, sentences):
+    generator = random.Random(0)
+    # A window longer than any sentence, so no word is committed early
+    streaming = StreamingSentenceSplitter(splitter, window=10_000)
+    for sentence in sentences:
+        words = []
+        position = 0
+        while position < len(sentence):
+            size = generator.randint(1, 5)
+            words += streaming.feed(sentence[position:position + size])
+            position += size
+        words += streaming.flush()
+        assert ' '.join(words) == splitter.viterbi_split_sentence(sentence)
+
+
+def test_expired_deadline_falls_back_to_greedy(splitter, sentences):
+    expired = time.monotonic() - 1
+    for sentence in sentences[:20]:
+        greedy = ' '.join(splitter.greedy_completion(sentence, 0, '<start>')[1])
+        assert splitter.split(sentence, 'viterbi', deadline=expired) == greedy
+        assert splitter.split(sentence, 'beam search', width=8, deadline=expired) == greedy
+        # Best first drops its lookahead to a single word
+        assert (splitter.split(sentence, 'best first', width=4, deadline=expired) ==
+                splitter.split(sentence, 'best first', width=1))
+        # A deadline that is not reached changes nothing
+        later = time.monotonic() + 3600
+        for mode in SPLITTER_MODES:
+            assert splitter.split(sentence, mode, deadline=later) == splitter.split(sentence, mode)
@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from phonemeDataset import PhonemeDataset, join_transcripts  # noqa: E402
+
+ROWS = [('clip_a', ['k', 'a'], [0.0, 0.1]),
+        ('clip_b', [], []),
+        ('clip_c', ['n', 'a', 'd', 'u'], [0.0, 0.2, 0.1, 0.3]),
+        ('clip_d', ['k'], [0.0])]
+
+
+def rows_of(dataset):
+    return [(dataset[row][0], dataset.phonemes(row), dataset[row][2].tolist()) for row in range(len(dataset))]
+
+
+def expected(*rows):
+    return [(ROWS[row][0], ROWS[row][1], np.float32(ROWS[row][2]).tolist()) for row in rows]
+
+
+def test_select_gathers_rows_in_the_given_order():
+    dataset = PhonemeDataset.from_rows(ROWS)
+    assert rows_of(dataset) == expected(0, 1, 2, 3)
+    # Out of order, repeated and empty rows
+    selected = dataset.select([2, 0, 1, 2], sentences=['one', 'two', 'three', 'four'])
+    assert rows_of(selected) == expected(2, 0, 1, 2)
+    assert selected.offsets.tolist() == [0, 4, 6, 6, 10]
+    assert selected.sentences == ['one', 'two', 'three', 'four']
+    assert len(dataset.select([])) == 0
+
+
+def test_join_transcripts_keeps_transcribed_rows_and_survives_save(tmp_path):
+    dataset = PhonemeDataset.from_rows(ROWS)
+    joined = join_transcripts(dataset, [('clip_d', 'ಕ'), ('missing', 'ಇಲ್ಲ'), ('clip_a', 'ಕಾ')])
+    assert rows_of(joined) == expected(3, 0)
+    assert joined.sentences == ['ಕ', 'ಕಾ']
+
+    joined.save(str(tmp_path))
+    loaded = PhonemeDataset.load(str(tmp_path))
+    assert rows_of(loaded) == expected(3, 0)
+    assert loaded.sentences == ['ಕ', 'ಕಾ']
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from phonemicTranscription import parse_timestamp_output, split_at_pauses  # noqa: E402
+
+
+def phonemes(*timed_labels):
+    return parse_timestamp_output('\n'.join(f'{start} 0.05 {label}' for start, label in timed_labels))
+
+
+def test_split_at_pauses_cuts_at_silences():
+    # Gaps of 0.05 s inside words and 0.45 s and 1.95 s between them
+    phones = phonemes((0.0, 'k'), (0.1, 'a'), (0.6, 'n'), (0.7, 'a'), (2.7, 'd'), (2.8, 'a'))
+    assert split_at_pauses(phones, min_pause=0.3) == [['k', 'a'], ['n', 'a'], ['d', 'a']]
+    assert split_at_pauses(phones, min_pause=1.0) == [['k', 'a', 'n', 'a'], ['d', 'a']]
+    assert split_at_pauses(phones, min_pause=5.0) == [['k', 'a', 'n', 'a', 'd', 'a']]
+    assert split_at_pauses(phonemes()) == []
+
+
+def test_split_at_pauses_caps_chunk_length_at_largest_gaps():
+    phones = phonemes((0.0, 'k'), (0.1, 'a'), (0.25, 'n'), (0.35, 'a'), (0.45, 'd'), (0.65, 'a'))
+    # No gap reaches min_pause, so the long chunk is cut at its largest gaps until it fits
+    assert split_at_pauses(phones, min_pause=1.0, max_phonemes=3) == [['k', 'a'], ['n', 'a', 'd'], ['a']]
+    assert all(len(chunk) <= 2 for chunk in split_at_pauses(phones, min_pause=1.0, max_phonemes=2))
@@ -0,0 +1,12 @@
+from textNormalization import join_runs, segmentation_runs, tokenize
+
+
+def test_punctuation_is_a_boundary_and_kept(splitter, sentences):
+    first, second = sentences[0], sentences[1]
+    runs, punctuation = segmentation_runs(f"{first[:5]} {first[5:]}, {second}.")
+    assert runs == [first, second, ''] and punctuation == [',', '.']
+
+    segmented = join_runs([splitter.split(run, 'viterbi') if run else '' for run in runs], punctuation)
+    assert segmented == f"{splitter.split(first, 'viterbi')}, {splitter.split(second, 'viterbi')}."
+    # The words are the ones the language model counts would give the same text
+    assert tokenize(segmented) == splitter.split(first, 'viterbi').split() + splitter.split(second, 'viterbi').split()
@@ -0,0 +1,44 @@
+import sys
+
+import pytest
+
+from transcriptionCache import TranscriptionCache, audio_key, content_key
+
+
+def test_memory_tier_evicts_least_recently_used():
+    value_size = sys.getsizeof('a' * 100)
+    cache = TranscriptionCache(max_memory_bytes=2 * value_size)
+    cache.put('phonemes', 'first', 'a' * 100)
+    cache.put('phonemes', 'second', 'b' * 100)
+    assert cache.get('phonemes', 'first') == 'a' * 100
+    # 'second' is now the least recently used entry
+    cache.put('phonemes', 'third', 'c' * 100)
+    assert cache.get('phonemes', 'second') is None
+    assert cache.get('phonemes', 'first') == 'a' * 100
+    assert cache.stats()['phonemes'] == {'memory_hits': 2, 'disk_hits': 0, 'misses': 1}
+    assert cache.stats()['memory_entries'] == 2
+
+
+def test_stages_are_separate_and_disk_tier_survives_restarts(tmp_path):
+    key = content_key('viterbi', 3, 'ಪದ')
+    cache = TranscriptionCache(disk_path=str(tmp_path))
+    cache.put('segmentation', key, 'ಪ ದ')
+    assert cache.get('lexemes', key) is None
+
+    restarted = TranscriptionCache(disk_path=str(tmp_path))
+    assert restarted.get('segmentation', key) == 'ಪ ದ'
+    assert restarted.get('segmentation', key) == 'ಪ ದ'
+    assert restarted.stats()['segmentation'] == {'memory_hits': 1, 'disk_hits': 1, 'misses': 0}
+
+
+def test_keys_depend_on_content_only():
+    assert content_key('viterbi', 3, 'ಪದ') == content_key('viterbi', '3', 'ಪದ')
+    # Parts are length prefixed, so moving characters between them changes the key
+    assert content_key('ab', 'c') != content_key('a', 'bc')
+
+
+def test_audio_key_hashes_samples():
+    np = pytest.importorskip('numpy')
+    samples = np.array([0.0, 0.5, -0.5], dtype=np.float32)
+    assert audio_key((samples, 16000)) == audio_key((samples.copy(), 16000))
+    assert audio_key((samples, 16000)) != audio_key((samples, 8000))
@@ -0,0 +1,52 @@
+import gc
+import os
+import tempfile
+
+from WebServer import ASRServer
+from scripts import metrics
+
+# WSGI entry point for the pre-forking server, see gunicorn.conf.py. The master imports this module once
+# (preload_app): the language model tables are mapped and the recognizer weights loaded here, before fork,
+# so the workers share those pages instead of each loading their own copy.
+
+
+def _environ(name, default, cast=str):
+    value = os.environ.get(name)
+    return default if value is None or value == '' else cast(value)
+
+
+server = ASRServer(max_batch_size=_environ('ASR_MAX_BATCH_SIZE', 8, int),
+                   batch_window_ms=_environ('ASR_BATCH_WINDOW_MS', 20, float),
+                   max_queue_depth=_environ('ASR_MAX_QUEUE_DEPTH', 64, int),
+                   job_workers=_environ('ASR_JOB_WORKERS', 2, int),
+                   max_queued_jobs=_environ('ASR_MAX_QUEUED_JOBS', 32, int),
+                   job_ttl=_environ('ASR_JOB_TTL', 3600, float),
+                   job_timeout=_environ('ASR_JOB_TIMEOUT', 300, float),
+                   # Made here in the master when unset, so every worker forked from it shares it
+                   job_dir=_environ('ASR_JOB_DIR', None),
+                   cache_memory_mb=_environ('ASR_CACHE_MEMORY_MB', 64, float),
+                   cache_dir=_environ('ASR_CACHE_DIR', None),
+                   max_ffmpeg_processes=_environ('ASR_MAX_FFMPEG_PROCESSES', 2, int),
+                   max_width=_environ('ASR_MAX_WIDTH', 32, int),
+                   max_depth=_environ('ASR_MAX_DEPTH', 6, int),
+                   request_timeout=_environ('ASR_REQUEST_TIMEOUT', 30, float),
+                   max_streams=_environ('ASR_MAX_STREAMS', 4, int),
+                   segment_workers=_environ('ASR_SEGMENT_WORKERS', None, int),
+                   max_segment_sentences=_environ('ASR_MAX_SEGMENT_SENTENCES', 10000, int),
+                   lexical_model_options={
+                       'converted_model_path': _environ('ASR_LEXICAL_MODEL_DIR', 'lexical-model/model_ct2'),
+                       'compute_type': _environ('ASR_COMPUTE_TYPE', 'default'),
+                       'intra_threads': _environ('ASR_INTRA_THREADS', 0, int),
+                       'beam_size': _environ('ASR_BEAM_SIZE', 5, int),
+                       'max_batch_tokens': _environ('ASR_MAX_BATCH_TOKENS', 0, int)},
+                   lazy_lexical_model=True)
+# Each worker writes its metrics here (see post_fork), and /metrics reports the sum over the workers
+metrics.registry.share(_environ('ASR_METRICS_DIR', None) or tempfile.mkdtemp(prefix='asr-metrics-'))
+# The translator starts threads, which do not survive fork, so the lexical model is only converted here (when
+# CTranslate2 can convert it) and loaded by each worker in post_fork
+server.asr_system.warm_up(load_lexical_model=False)
+# Move everything loaded so far out of the collector's reach, so collections in the workers do not touch
+# (and copy) the shared pages
+gc.freeze()
+
+app = server.app